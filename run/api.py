@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import re
+import sys
+import json
+import asyncio
+import selectors
+import threading
+import traceback
+import contextlib
+from .task import Task
+from . import resources
+from . import results
+from . import helpers
+
+
+# Module API
+
+class RunError(Exception):
+
+    # Public
+
+    def __init__(self, result):
+        message = 'Task "%s" has failed with code %s' % (' '.join(result.argv), result.returncode)
+        super(RunError, self).__init__(message)
+        self._result = result
+
+    @property
+    def result(self):
+        return self._result
+
+
+class ConfigError(Exception):
+    pass
+
+
+class Result(object):
+
+    # Public
+
+    def __init__(self, argv, returncode, output, commands):
+        self._argv = argv
+        self._returncode = returncode
+        self._output = output
+        self._commands = commands
+
+    @property
+    def argv(self):
+        return self._argv
+
+    @property
+    def returncode(self):
+        return self._returncode
+
+    @property
+    def output(self):
+        return self._output
+
+    @property
+    def commands(self):
+        return self._commands
+
+
+class Runner(object):
+
+    # Public
+
+    def __init__(self, path='run.yml', options=None, nocache=False):
+        # Loading reports errors by printing a message and exiting
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                config, config_options = helpers.read_config(path, nocache=nocache)
+                config_options.update(options or {})
+                config_options['capture'] = True
+                if nocache:
+                    config_options['nocache'] = True
+                self._task = Task(config, options=config_options)
+            self._spec = [os.path.abspath(path), options or {}, nocache]
+        except SystemExit:
+            message = _strip_styles(output.getvalue()) or 'Config "%s" is not valid' % path
+            raise ConfigError(message) from None
+
+    @property
+    def task(self):
+        return self._task
+
+    def run(self, argv=(), environ=None, check=True):
+        pid, output, report = self._fork(argv, environ)
+        output, report = _read_all([output, report])
+        _, status = os.waitpid(pid, 0)
+        return self._finish(argv, status, output, report, check)
+
+    async def run_async(self, argv=(), environ=None, check=True):
+        loop = asyncio.get_running_loop()
+        pid, output, report = self._fork(argv, environ)
+        output, report = await asyncio.gather(
+            _read_async(loop, output), _read_async(loop, report))
+        status = await _wait_async(loop, pid)
+        return self._finish(argv, status, output, report, check)
+
+    # Private
+
+    def _fork(self, argv, environ):
+        output_read, output_write = os.pipe()
+        report_read, report_write = os.pipe()
+
+        # Spawn a fresh worker if other threads are running (forking might deadlock)
+        if threading.active_count() > 1:
+            try:
+                pid = os.posix_spawn(sys.executable,
+                    [sys.executable, '-c', _BOOTSTRAP, _PACKAGE, __name__,
+                        json.dumps(self._spec + [list(argv)])],
+                    os.environ if environ is None else environ,
+                    file_actions=[
+                        (os.POSIX_SPAWN_DUP2, output_write, 1),
+                        (os.POSIX_SPAWN_DUP2, output_write, 2),
+                        (os.POSIX_SPAWN_DUP2, report_write, _REPORT_FD)])
+            finally:
+                os.close(output_write)
+                os.close(report_write)
+            return pid, output_read, report_read
+
+        # Fork a worker sharing the loaded task
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            os.close(output_write)
+            os.close(report_write)
+            return pid, output_read, report_read
+
+        # Child runs the task with its own stdio and environ
+        returncode = 1
+        try:
+            os.close(output_read)
+            os.close(report_read)
+            os.dup2(output_write, 1)
+            os.dup2(output_write, 2)
+            # The embedding process might have replaced the stdio streams
+            sys.stdout = io.open(1, 'w', closefd=False)
+            sys.stderr = io.open(2, 'w', closefd=False)
+            if environ is not None:
+                os.environ.clear()
+                os.environ.update(environ)
+            returncode = _run_task(self._task, list(argv))
+            _write_report(report_write)
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(returncode)
+
+    def _finish(self, argv, status, output, report, check):
+        commands = json.loads(report.decode('utf-8')) if report else []
+        result = Result(list(argv), os.waitstatus_to_exitcode(status),
+            output.decode('utf-8', 'replace'), commands)
+        if check and result.returncode != 0:
+            raise RunError(result)
+        return result
+
+
+# Internal
+
+_PACKAGE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_REPORT_FD = 3
+_POLL_INTERVAL = 0.05
+_BOOTSTRAP = '''
+import sys, json, importlib
+sys.path.insert(0, sys.argv[1])
+module = importlib.import_module(sys.argv[2])
+sys.exit(module._work(*json.loads(sys.argv[3])))
+'''
+
+
+def _work(path, options, nocache, argv):
+    returncode = 1
+    try:
+        returncode = _run_task(Runner(path, options, nocache).task, argv)
+        _write_report(_REPORT_FD)
+    except ConfigError as exception:
+        print(exception, file=sys.stderr)
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    return returncode
+
+
+def _write_report(descriptor):
+    with os.fdopen(descriptor, 'wb') as file:
+        file.write(json.dumps(_get_report()).encode('utf-8'))
+
+
+def _run_task(task, argv):
+    try:
+        task.run(argv)
+    except SystemExit as exception:
+        if exception.code is None:
+            return 0
+        if isinstance(exception.code, int):
+            return exception.code
+        print(exception.code, file=sys.stderr)
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def _get_report():
+    outputs = results.get_outputs()
+    report = []
+    for record in resources.get_records():
+        command = dict(record, output=None)
+        for index, (name, code, output) in enumerate(outputs):
+            if [name, code] == [record['name'], record['code']]:
+                command['output'] = output.decode('utf-8', 'replace')
+                outputs.pop(index)
+                break
+        report.append(command)
+    return report
+
+
+def _read_all(descriptors):
+    # Pipes are drained together so neither fills up and blocks the child
+    chunks = {descriptor: [] for descriptor in descriptors}
+    with selectors.DefaultSelector() as selector:
+        for descriptor in descriptors:
+            selector.register(descriptor, selectors.EVENT_READ)
+        while selector.get_map():
+            for key, _ in selector.select():
+                chunk = os.read(key.fd, 65536)
+                if chunk:
+                    chunks[key.fd].append(chunk)
+                    continue
+                selector.unregister(key.fd)
+                os.close(key.fd)
+    return [b''.join(chunks[descriptor]) for descriptor in descriptors]
+
+
+def _strip_styles(text):
+    return re.sub(r'\x1b\[[0-9;]*m', '', text).strip()
+
+
+async def _wait_async(loop, pid):
+    try:
+        descriptor = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        descriptor = None
+
+    # Poll without a pidfd
+    if descriptor is None:
+        while True:
+            waited, status = os.waitpid(pid, os.WNOHANG)
+            if waited:
+                return status
+            await asyncio.sleep(_POLL_INTERVAL)
+
+    # Wait for the pidfd to become readable
+    future = loop.create_future()
+    loop.add_reader(descriptor, lambda: future.done() or future.set_result(None))
+    try:
+        await future
+    finally:
+        loop.remove_reader(descriptor)
+        os.close(descriptor)
+    return os.waitpid(pid, 0)[1]
+
+
+async def _read_async(loop, descriptor):
+    chunks = []
+    future = loop.create_future()
+
+    def read():
+        chunk = os.read(descriptor, 65536)
+        if chunk:
+            chunks.append(chunk)
+            return
+        loop.remove_reader(descriptor)
+        os.close(descriptor)
+        future.set_result(b''.join(chunks))
+
+    loop.add_reader(descriptor, read)
+    return await future
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import glob
+import json
+import time
+import pickle
+import shutil
+import hashlib
+import tempfile
+
+
+# Module API
+
+def get_cache_path(*names):
+    base = os.environ.get('RUNCACHE')
+    if not base:
+        home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        base = os.path.join(home, 'run')
+    return os.path.join(base, *names)
+
+
+def get_file_key(path):
+    path = os.path.abspath(path)
+    return hashlib.sha1(path.encode('utf-8')).hexdigest()
+
+
+def get_key(*parts):
+    contents = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(contents.encode('utf-8')).hexdigest()
+
+
+def get_files_stat(patterns):
+    stats = []
+    for pattern in patterns or []:
+        for path in sorted(glob.glob(pattern, recursive=True)):
+            if os.path.isfile(path):
+                stats.append([path] + get_file_stat(path))
+    return stats
+
+
+def get_file_stat(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def load_pickle(path):
+    try:
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+    except Exception:
+        return None
+
+
+def dump_pickle(path, data):
+    write_file(path, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def write_file(path, contents):
+    try:
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        descriptor, temp_path = tempfile.mkstemp(dir=dirname, prefix='.')
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(contents)
+        os.replace(temp_path, path)
+    except OSError:
+        pass
+
+
+def read_entry(name, key, ttl=None):
+    path = get_cache_path(name, key)
+    entry = load_pickle(path)
+    if entry is None:
+        return None
+    if ttl is not None and time.time() - entry['time'] > ttl:
+        return None
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return entry['data']
+
+
+def write_entry(name, key, data, limit=None):
+    dump_pickle(get_cache_path(name, key), {'time': time.time(), 'data': data})
+    if limit is not None:
+        evict_entries(name, limit)
+
+
+def evict_entries(name, limit):
+    evict_directory(get_cache_path(name), limit)
+
+
+def evict_directory(dirname, limit):
+    entries = []
+    total = 0
+    for filename in os.listdir(dirname):
+        # Dot-prefixed entries are other writers' temporary files
+        if filename.startswith('.'):
+            continue
+        path = os.path.join(dirname, filename)
+        try:
+            stat = os.stat(path)
+            size = _get_size(path) if os.path.isdir(path) else stat.st_size
+        except OSError:
+            continue
+        entries.append([stat.st_mtime, size, filename])
+        total += size
+    for _, size, filename in sorted(entries):
+        if total <= limit:
+            break
+        path = os.path.join(dirname, filename)
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def clear_cache(*names):
+    shutil.rmtree(get_cache_path(*names), ignore_errors=True)
+
+
+# Internal
+
+def _get_size(path):
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return size
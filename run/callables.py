@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import re
+import sys
+import shlex
+import importlib
+import threading
+import traceback
+import subprocess
+import contextlib
+
+
+# Module API
+
+def is_callable(code):
+    return code.startswith(_PREFIX)
+
+
+def call(code, environ, capture=False):
+    output = io.StringIO() if capture else None
+    with _redirect(output):
+        returncode = _invoke(code, environ)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    if capture:
+        return returncode, output.getvalue().encode('utf-8')
+    return returncode, None
+
+
+def spawn(code, environ, stdout):
+
+    # Exec a fresh interpreter if other threads are running (forking might deadlock)
+    if threading.active_count() > 1:
+        package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        return subprocess.Popen(
+            [sys.executable, '-c', _BOOTSTRAP, package, __name__, code],
+            env=environ, stdout=stdout, stderr=stdout, **_GROUP_OPTIONS)
+
+    # Warm up (forked children inherit the imported modules)
+    try:
+        _resolve(code)
+    except Exception:
+        pass
+
+    # Fork worker
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        return _Process(pid)
+    returncode = 1
+    try:
+        os.setsid()
+        os.dup2(stdout, 1)
+        os.dup2(stdout, 2)
+        returncode = _invoke(code, environ)
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(returncode)
+
+
+# Internal
+
+_PREFIX = 'py:'
+_GROUP_OPTIONS = {'start_new_session': True}
+_BOOTSTRAP = '''
+import os, sys, importlib
+sys.path.insert(0, sys.argv[1])
+module = importlib.import_module(sys.argv[2])
+sys.exit(module._invoke(sys.argv[3], os.environ))
+'''
+
+
+class _Process(object):
+
+    # Public
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+        self.stdout = None
+
+
+def _resolve(code):
+    target = code[len(_PREFIX):].split(None, 1)[0]
+    module, _, function = target.partition(':')
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    return getattr(importlib.import_module(module), function)
+
+
+def _invoke(code, environ):
+    try:
+        function = _resolve(code)
+        parts = code[len(_PREFIX):].split(None, 1)
+        argv = shlex.split(_expand(parts[1], environ)) if len(parts) > 1 else []
+        result = function(argv, environ)
+    except SystemExit as exception:
+        result = exception.code
+    except Exception:
+        traceback.print_exc()
+        return 1
+    if result is None or result is True:
+        return 0
+    if result is False:
+        return 1
+    if isinstance(result, int):
+        return result
+    print(result, file=sys.stderr)
+    return 1
+
+
+def _expand(text, environ):
+    return re.sub(r'\$(?:(\w+)|\{(\w+)\})',
+        lambda match: environ.get(match.group(1) or match.group(2), ''), text)
+
+
+@contextlib.contextmanager
+def _redirect(output):
+    if output is None:
+        yield
+        return
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        yield
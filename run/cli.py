@@ -5,8 +5,9 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import sys
-from .task import Task
-from . import helpers
+from . import cache
+from . import completion
+from . import trace
 
 
 # Main program
@@ -23,19 +24,102 @@ if __name__ == '__main__':
         path = argv.pop(index + 1)
         argv.pop(index)
 
+    # Jobs argument
+    jobs = None
+    if '--run-jobs' in argv:
+        index = argv.index('--run-jobs')
+        jobs = int(argv.pop(index + 1))
+        argv.pop(index)
+
+    # Keep going argument
+    keep_going = False
+    if '--run-keep-going' in argv:
+        argv.remove('--run-keep-going')
+        keep_going = True
+
+    # Shard argument
+    shard = None
+    if '--run-shard' in argv:
+        index = argv.index('--run-shard')
+        shard = argv.pop(index + 1)
+        argv.pop(index)
+    shard_timings = None
+    if '--run-shard-timings' in argv:
+        index = argv.index('--run-shard-timings')
+        shard_timings = argv.pop(index + 1)
+        argv.pop(index)
+
+    # Usage arguments
+    usage = False
+    if '--run-usage' in argv:
+        argv.remove('--run-usage')
+        usage = True
+    usage_json = None
+    if '--run-usage-json' in argv:
+        index = argv.index('--run-usage-json')
+        usage_json = argv.pop(index + 1)
+        argv.pop(index)
+
+    # Trace argument
+    if '--run-trace' in argv:
+        index = argv.index('--run-trace')
+        trace.start(argv.pop(index + 1))
+        argv.pop(index)
+
     # Complete argument
     complete = False
     if '--run-complete' in argv:
         argv.remove('--run-complete')
         complete = True
 
-    # Prepare
-    config, options = helpers.read_config(path)
+    # Cache arguments
+    nocache = False
+    if '--run-no-cache' in argv:
+        argv.remove('--run-no-cache')
+        nocache = True
+    if '--run-clear-cache' in argv:
+        argv.remove('--run-clear-cache')
+        for name in ['config', 'variables', 'results']:
+            cache.clear_cache(name)
+
+    # Complete from index
+    if complete and not nocache:
+        index = completion.read_index(path)
+        if index:
+            completion.complete(index, argv)
+            exit()
+
+    # Prepare (imported here to keep yaml/click off the completion path)
+    trace.begin('load config')
+    from .task import Task
+    from . import helpers
+    config, options = helpers.read_config(path, nocache=nocache)
+    trace.end('load config')
+    if nocache:
+        options['nocache'] = True
+    if jobs:
+        options['jobs'] = jobs
+    if keep_going:
+        options['keep_going'] = True
+    if shard:
+        options['shard'] = shard
+    if shard_timings:
+        options['shard_timings'] = shard_timings
+    if usage:
+        options['usage'] = True
+    if usage_json:
+        options['usage_json'] = usage_json
+    trace.begin('build tree')
     task = Task(config, options=options)
+    trace.end('build tree')
 
     # Complete
     if complete:
-        task.complete(argv)
+        if nocache:
+            index = completion.build_index(task)
+        else:
+            index = completion.write_index(path, task)
+        completion.complete(index, argv)
         exit()
 
     # Run
@@ -11,10 +11,11 @@ class Command(object):
 
     # Public
 
-    def __init__(self, name, code, variable=None):
+    def __init__(self, name, code, variable=None, options=None):
         self._name = name
         self._code = code
         self._variable = variable
+        self._options = options or {}
 
     @property
     def name(self):
@@ -31,3 +32,7 @@ class Command(object):
     @property
     def variable(self):
         return self._variable
+
+    @property
+    def options(self):
+        return self._options
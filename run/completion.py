@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import json
+import time
+from . import cache
+
+
+# Module API
+
+def build_index(task):
+    index = {'tasks': {}, 'abbrevations': {}}
+    _index_task(task, [], index['tasks'])
+    _index_abbrevations(task, '', [], index['abbrevations'])
+    return index
+
+
+def read_index(path):
+    entry = None
+    try:
+        with open(_get_index_path(path), 'rb') as file:
+            entry = json.loads(file.read().decode('utf-8'))
+        stat = cache.get_file_stat(path)
+    except (OSError, ValueError):
+        return None
+    if entry.get('stat') != stat or stat[0] >= entry.get('time', 0) - _INDEX_RACE:
+        return None
+    for include_path, include_stat in entry.get('includes', []):
+        try:
+            stat = cache.get_file_stat(include_path)
+        except OSError:
+            return None
+        if stat != include_stat or stat[0] >= entry['time'] - _INDEX_RACE:
+            return None
+    return entry
+
+
+def write_index(path, task):
+    index = build_index(task)
+    index['time'] = time.time_ns()
+    index['stat'] = cache.get_file_stat(path)
+    index['includes'] = []
+    for child in task.flatten_childs_with_composite:
+        if child.include and os.path.isfile(child.include):
+            index['includes'].append([child.include, cache.get_file_stat(child.include)])
+    cache.write_file(_get_index_path(path), json.dumps(index).encode('utf-8'))
+    return index
+
+
+def complete(index, argv):
+    tasks = index['tasks']
+    names = []
+
+    # Delegate by name
+    while argv and argv[0] in tasks[_get_key(names)]['childs']:
+        names.append(argv.pop(0))
+
+    # Delegate by abbrevation
+    if argv and not names and argv[0] in index['abbrevations']:
+        names = index['abbrevations'][argv.pop(0)]
+        while argv and argv[0] in tasks[_get_key(names)]['childs']:
+            names.append(argv.pop(0))
+
+    # Autocomplete filters
+    entry = tasks[_get_key(names)]
+    if names and argv and argv[-1][:1] in ['=', '+', '-']:
+        for name in entry['filters']:
+            print(argv[-1][0] + name)
+        return True
+
+    # Autocomplete
+    for name in entry['childs']:
+        print(name)
+
+    return True
+
+
+# Internal
+
+_INDEX_RACE = 2 * 10 ** 9
+
+
+def _index_task(task, names, tasks):
+    key = _get_key(names)
+    if key in tasks:
+        return
+    tasks[key] = {'childs': [], 'filters': []}
+    for child in task.childs:
+        if child.name:
+            tasks[key]['childs'].append(child.name)
+            _index_task(child, names + [child.name], tasks)
+    for child in task.flatten_general_tasks:
+        if child is not task and child.name and child.name not in tasks[key]['filters']:
+            tasks[key]['filters'].append(child.name)
+
+
+def _index_abbrevations(task, prefix, names, abbrevations):
+    letters = set()
+    for child in task.childs:
+        if not child.name or child.name[0] in letters:
+            continue
+        letters.add(child.name[0])
+        abbrevation = prefix + child.name[0]
+        abbrevations[abbrevation] = names + [child.name]
+        _index_abbrevations(child, abbrevation, names + [child.name], abbrevations)
+
+
+def _get_key(names):
+    return ' '.join(names)
+
+
+def _get_index_path(path):
+    return cache.get_cache_path('config', '%s.complete' % cache.get_file_key(path))
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import re
+import shlex
+import shutil
+
+
+# Module API
+
+def get_argv(code, environ):
+
+    # Reject shell syntax (references are checked separately)
+    stripped = _REFERENCE.sub('', code)
+    if _SHELL_SYNTAX.search(stripped):
+        return None
+    if stripped != code and ('"' in code or "'" in code):
+        return None
+
+    # Split words
+    try:
+        words = shlex.split(code)
+    except ValueError:
+        return None
+
+    # Expand references like an unquoted word in the shell would
+    argv = []
+    for word in words:
+        match = _REFERENCE.fullmatch(word)
+        if not match:
+            if '$' in word:
+                return None
+            argv.append(word)
+            continue
+        value = environ.get(match.group(1) or match.group(2))
+        if value is None or _GLOB.search(value):
+            return None
+        argv.extend(word for word in _FIELDS.split(value) if word)
+
+    # Resolve program
+    if not argv or argv[0] in _BUILTINS or '=' in argv[0] or '/' in argv[0]:
+        return None
+    path = shutil.which(argv[0], path=environ.get('PATH'))
+    if not path:
+        return None
+
+    return path, argv
+
+
+# Internal
+
+_REFERENCE = re.compile(r'\$(?:(\w+)|\{(\w+)\})')
+_SHELL_SYNTAX = re.compile(r'[|&;<>()`\\*?\[\]{}~#!$\n]')
+_GLOB = re.compile(r'[*?\[]')
+_FIELDS = re.compile(r'[ \t\n]+')
+_BUILTINS = set([
+    '.', ':', 'alias', 'bg', 'break', 'case', 'cd', 'command', 'continue', 'do', 'done',
+    'echo', 'elif', 'else', 'esac', 'eval', 'exec', 'exit', 'export', 'fg', 'fi', 'for',
+    'function', 'getopts', 'hash', 'if', 'jobs', 'kill', 'local', 'printf', 'pwd', 'read',
+    'readonly', 'return', 'select', 'set', 'shift', 'source', 'test', 'then', 'time',
+    'times', 'trap', 'type', 'ulimit', 'umask', 'unalias', 'unset', 'until', 'wait', 'while',
+])
@@ -4,98 +4,1043 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import io
+import os
+import re
 import sys
-import click
-import select
+import time
+import errno
+import atexit
+import codecs
+import tempfile
+import signal
+import selectors
+import threading
 import subprocess
+from concurrent import futures
 from . import helpers
-from .faketty import apply_faketty
+from . import cache
+from . import trace
+from . import resources
+from . import results
+from . import callables
+from . import direct
+from .faketty import open_faketty, popen_faketty
+from .writer import Writer
 
 
 # Module API
 
-def execute_sync(commands, environ, quiet=False):
+def execute_sync(commands, environ, quiet=False, session=False, cancel=None):
+
+    # Session
+    if session and not any(callables.is_callable(command.code) for command in commands):
+        return _execute_session(commands, environ, quiet=quiet)
+
+    lane = trace.lane('sequence')
     for command in commands:
+        if cancel and cancel.cancelled:
+            exit(1)
+
+        # Evaluate variable
+        if command.variable:
+            returncode, output, _, _ = _evaluate_variable(command, environ)
+            if returncode != 0:
+                message = '[run] Command "%s" has failed' % command.code
+                helpers.print_message('general', message=message)
+                exit(1)
+            environ[command.variable] = output
+            continue
 
         # Log process
-        if not command.variable and not quiet:
+        if not quiet:
             sys.stdout.write('[run] Launched "%s"\n' % command.code)
             sys.stdout.flush()
 
+        # Prepare process
+        trace.begin(command.code, lane=lane, task=command.name)
+        started = time.monotonic()
+        capture = results.is_tracked(command)
+
+        # Call function
+        if callables.is_callable(command.code):
+            baseline = resources.snapshot()
+            returncode, output = callables.call(command.code, environ, capture=capture)
+            resources.record(command, returncode, started, resources.snapshot(), baseline)
+            if output:
+                results.capture(command, output)
+                getattr(sys.stdout, 'buffer', sys.stdout).write(output)
+                sys.stdout.flush()
+
         # Create process
-        stdout = None if not command.variable else subprocess.PIPE
-        stderr = None if not command.variable else subprocess.STDOUT
-        process = subprocess.Popen(command.code,
-            shell=True, env=environ, stdout=stdout, stderr=stderr)
-
-        # Wait process
-        output, _ = process.communicate()
-        if process.returncode != 0:
+        else:
+            stdout = None if not capture else subprocess.PIPE
+            stderr = None if not capture else subprocess.STDOUT
+            # Cancellable processes get their own group to be signalled as a whole
+            options = _GROUP_OPTIONS if cancel else {}
+            process = _popen(command, environ, stdout=stdout, stderr=stderr, **options)
+            if cancel:
+                cancel.register(process)
+            if capture:
+                _tee_output(process, command)
+            returncode = resources.wait(process, started, command)
+            if cancel:
+                cancel.unregister(process)
+
+        # Check result
+        trace.end(command.code, lane=lane, returncode=returncode)
+        results.finish(command, returncode)
+        if returncode != 0:
+            if cancel and cancel.cancelled:
+                exit(1)
             message = '[run] Command "%s" has failed' % command.code
             helpers.print_message('general', message=message)
             exit(1)
-        if command.variable:
-            environ[command.variable] = output.decode().strip()
 
 
-def execute_async(commands, environ, multiplex=False, quiet=False, faketty=False):
+def execute_variables(commands, environ, workers=8, nocache=False, cache_size=None,
+        capture=None):
+
+    # Resolve dependencies
+    depends = []
+    for index, command in enumerate(commands):
+        names = set(get_references(command.code)) - set([command.variable])
+        depends.append(set())
+        for previous, other in enumerate(commands[:index]):
+            if other.variable in names or other.variable == command.variable:
+                depends[index].add(previous)
 
-    # Launch processes
-    processes = []
+    # Evaluate variables
+    done = set()
+    pending = {}
+    sources = {}
+    waiting = list(range(len(commands)))
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while waiting or pending:
+
+            # Submit ready variables
+            for index in list(waiting):
+                if depends[index] <= done:
+                    waiting.remove(index)
+                    command = commands[index]
+                    if command.options.get('cache') and not nocache:
+                        value = read_variable_cache(command, environ)
+                        if value is not None:
+                            trace.instant('variable %s (cached)' % command.variable)
+                            environ[command.variable] = value
+                            sources[command.variable] = 'cached'
+                            done.add(index)
+                            continue
+                    if callables.is_callable(command.code):
+                        # Callables are evaluated on the main thread (see _evaluate_variable)
+                        future = futures.Future()
+                        future.set_result(_evaluate_variable(command, dict(environ),
+                            capture=capture))
+                    else:
+                        future = executor.submit(_evaluate_variable, command, dict(environ),
+                            capture=capture)
+                    pending[future] = (index, dict(environ))
+            if not pending:
+                continue
+
+            # Collect finished variables
+            finished, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in sorted(finished, key=lambda future: pending[future][0]):
+                index, snapshot = pending.pop(future)
+                command = commands[index]
+                returncode, output, size, spilled = future.result()
+                if returncode != 0:
+                    message = '[run] Variable "%s" has failed' % command.variable
+                    helpers.print_message('general', message=message)
+                    exit(1)
+                environ[command.variable] = output
+                done.add(index)
+                if spilled:
+                    sources[command.variable] = 'spilled %s bytes to file' % size
+                    continue
+                if command.options.get('cache'):
+                    sources[command.variable] = 'computed'
+                    if not nocache:
+                        cache.write_entry('variables', _get_variable_key(command, snapshot),
+                            output, limit=cache_size or _CACHE_SIZE)
+
+    return sources
+
+
+def read_variable_cache(command, environ):
+    settings = command.options.get('cache')
+    if not isinstance(settings, dict):
+        settings = {}
+    key = _get_variable_key(command, environ)
+    return cache.read_entry('variables', key, ttl=settings.get('ttl'))
+
+
+def execute_async(commands, environ, multiplex=False, quiet=False, faketty=False, buffered=None,
+        jobs=None, max_load=None, min_memory=None, keep_going=False, grace_period=None,
+        durations=None, output_rate=None, log=None, cancel=None):
+    selector = selectors.DefaultSelector()
+    writer = Writer(buffered=buffered)
+
+    # Prepare processes
     color_iterator = helpers.iter_colors()
+    processes = [_Child(command, next(color_iterator)) for command in commands]
+    children = list(processes)
+    queue = _sort_longest_first(processes, durations)
+    failures = []
+    running = 0
+    output = _Output(writer, children, multiplex=multiplex, quiet=quiet,
+        rate=output_rate, log=log)
+    handlers = _handle_signals()
+
+    # Wait processes
+    try:
+        while processes:
+
+            # Process cancellation
+            if cancel and cancel.cancelled:
+                _terminate_children(selector, children, grace_period)
+                exit(1)
+
+            # Launch processes
+            while queue and (not jobs or running < jobs):
+                if running and _is_overloaded(max_load, min_memory):
+                    break
+                child = queue.pop(0)
+                if not quiet:
+                    writer.flush()
+                    sys.stdout.write('[run] Launched "%s"\n' % child.command.code)
+                    sys.stdout.flush()
+                child.launch(environ, faketty=faketty)
+                selector.register(child.stdout, selectors.EVENT_READ, (child, 'output'))
+                if child.exitfd is not None:
+                    selector.register(child.exitfd, selectors.EVENT_READ, (child, 'exit'))
+                running += 1
+
+            # Wait events
+            timeout = None
+            if queue and (not jobs or running < jobs):
+                timeout = _LOAD_TIMEOUT
+            if cancel:
+                timeout = _min_timeout(timeout, _POLL_TIMEOUT)
+            running -= _wait_children(selector, children,
+                _min_timeout(timeout, writer.timeout, output.timeout))
+
+            # Print output
+            for index, child in enumerate(processes):
+                if multiplex or index == 0:
+                    output.write(child)
+
+            # Process failure
+            for child in processes:
+                if child.failed and child not in failures:
+                    failures.append(child)
+                    if not keep_going:
+                        output.write(child)
+                        _terminate_children(selector, children, grace_period)
+                        for index, other in enumerate(processes):
+                            if multiplex or index == 0:
+                                output.write(other)
+                        writer.flush()
+                        message = '[run] Command "%s" has failed' % failures[0].command.code
+                        helpers.print_message('general', message=message)
+                        exit(1)
+
+            # Process finish
+            while processes and processes[0].finished:
+                processes.pop(0)
+                if processes and not multiplex:
+                    output.write(processes[0])
+
+            # Flush output
+            if writer.timeout == 0:
+                writer.flush()
+
+    # Process interruption
+    except (KeyboardInterrupt, _Terminated):
+        _terminate_children(selector, children, grace_period)
+        raise
+
+    finally:
+        _restore_signals(handlers)
+        writer.flush()
+        output.close()
+        selector.close()
+
+    # Report failures
+    if failures:
+        for child in failures:
+            message = '[run] Command "%s" has failed' % child.command.code
+            helpers.print_message('general', message=message)
+        exit(1)
+
+
+def execute_graph(nodes, environ, quiet=False, faketty=False, buffered=None, jobs=None,
+        keep_going=False, grace_period=None, durations=None, output_rate=None):
+    priorities = _get_graph_priorities(nodes, durations)
+    if grace_period is None:
+        grace_period = _GRACE_PERIOD
+
+    # Execute nodes
+    done = set()
+    failed = []
+    pending = {}
+    waiting = list(nodes)
+    cancel = _Cancel()
+    deadline = None
+    handlers = _handle_signals()
+    with futures.ThreadPoolExecutor(max_workers=jobs or len(nodes) or 1) as executor:
+        try:
+            while waiting or pending:
+
+                # Submit ready nodes
+                if keep_going or not failed:
+                    ready = [node for node in waiting if set(node['needs']) <= done]
+                    ready.sort(key=lambda node: -priorities[node['name']])
+                    for node in ready:
+                        if jobs and len(pending) >= jobs:
+                            break
+                        waiting.remove(node)
+                        future = executor.submit(_execute_node, node, environ,
+                            quiet=quiet, faketty=faketty, buffered=buffered,
+                            keep_going=keep_going, grace_period=grace_period,
+                            durations=durations, output_rate=output_rate, cancel=cancel)
+                        pending[future] = node
+                if not pending:
+                    break
+
+                # Kill running nodes after the grace period
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        cancel.cancel(signal.SIGKILL)
+                        deadline = timeout = None
+
+                # Collect finished nodes
+                finished, _ = futures.wait(pending, timeout=timeout,
+                    return_when=futures.FIRST_COMPLETED)
+                for future in finished:
+                    node = pending.pop(future)
+                    if future.result():
+                        done.add(node['name'])
+                        continue
+                    failed.append(node)
+
+                    # Cancel running nodes
+                    if not keep_going and not cancel.cancelled:
+                        cancel.cancel(signal.SIGTERM)
+                        deadline = time.monotonic() + grace_period
+
+        # Process interruption
+        except (KeyboardInterrupt, _Terminated):
+            cancel.cancel(signal.SIGTERM)
+            raise
+
+        finally:
+            _restore_signals(handlers)
+
+    # Log skipped nodes
+    if keep_going and not quiet:
+        for node in waiting:
+            sys.stdout.write('[run] Skipped "%s" (dependency failed)\n' % node['name'])
+        sys.stdout.flush()
+
+    # Process failure
+    if failed:
+        exit(1)
+
+
+def get_references(code):
+    for match in re.finditer(r'\$(?:(\w+)|\{(\w+)\})', code):
+        yield match.group(1) or match.group(2)
+
+
+def get_graph_levels(nodes):
+    levels = []
+    done = set()
+    waiting = list(nodes)
+    while waiting:
+        level = [node for node in waiting if set(node['needs']) <= done]
+        if not level:
+            return None
+        for node in level:
+            waiting.remove(node)
+        done.update(node['name'] for node in level)
+        levels.append(level)
+    return levels
+
+
+def get_graph_length(nodes, durations=None):
+    priorities = _get_graph_priorities(nodes, durations)
+    return max(priorities.values()) if priorities else 0
+
+
+# Internal
+
+_CACHE_SIZE = 16 * 1024 * 1024
+_GRACE_PERIOD = 5
+_LOAD_TIMEOUT = 0.5
+_POLL_TIMEOUT = 0.05
+_PARTIAL_TIMEOUT = 0.2
+_SUPPRESSED = b'[run] %d lines suppressed\n'
+_READ_SIZE = 65536
+# A new session (not just a process group) keeps children out of terminal job control
+_GROUP_OPTIONS = {'start_new_session': True}
+_NOT_EXECUTABLE = (errno.ENOEXEC, errno.EACCES)
+_CAPTURE_DEFAULTS = {
+    # A single environment string can't exceed MAX_ARG_STRLEN (128KB) on Linux
+    'limit': 128 * 1024,
+    'overflow': 'fail',
+    'encoding': 'utf-8',
+    'errors': 'strict',
+}
+# Commands are eval'd in one shell, so "exit" ends the session: its status
+# becomes the command's status and later commands start a fresh session
+_SESSION_SCRIPT = '''
+__run_code_fd=$1
+__run_status_fd=$2
+set --
+while IFS= read -r -d '' -u "$__run_code_fd" __run_code; do
+    eval "$__run_code"
+    printf '%s\\n' "$?" >&"$__run_status_fd"
+done
+'''
+
+
+def _get_graph_priorities(nodes, durations=None):
+    priorities = {}
+    for level in reversed(get_graph_levels(nodes) or []):
+        for node in level:
+            priority = 0
+            for other in nodes:
+                if node['name'] in other['needs']:
+                    priority = max(priority, priorities[other['name']])
+            priorities[node['name']] = priority + _get_node_weight(node, durations)
+    return priorities
+
+
+def _get_node_weight(node, durations=None):
+    if not durations:
+        return max(len(node['commands']), 1)
+    weights = []
+    for command in node['commands']:
+        duration = durations.get(command)
+        weights.append(duration if duration is not None else 0)
+    if not weights:
+        return 0
+    if node['mode'] in ['parallel', 'multiplex']:
+        return max(weights)
+    return sum(weights)
+
+
+def _execute_node(node, environ, quiet=False, faketty=False, buffered=None,
+        keep_going=False, grace_period=None, durations=None, output_rate=None, cancel=None):
+    try:
+        if node['mode'] in ['parallel', 'multiplex']:
+            execute_async(node['commands'], environ,
+                multiplex=node['mode'] == 'multiplex',
+                quiet=quiet, faketty=faketty, buffered=buffered,
+                keep_going=keep_going, grace_period=grace_period, durations=durations,
+                output_rate=output_rate, cancel=cancel)
+        else:
+            execute_sync(node['commands'], environ, quiet=quiet, cancel=cancel)
+    except SystemExit as exception:
+        return not exception.code
+    return True
+
+
+def _get_variable_key(command, environ):
+    settings = command.options.get('cache')
+    if not isinstance(settings, dict):
+        settings = {}
+    names = set(get_references(command.code)) | set(settings.get('env') or [])
+    return cache.get_key(
+        command.code,
+        os.getcwd(),
+        cache.get_files_stat(command.options.get('inputs')),
+        [[name, environ.get(name)] for name in sorted(names)])
+
+
+def _evaluate_variable(command, environ, capture=None):
+    lane = trace.lane('variable %s' % command.variable)
+    trace.begin(command.variable, lane=lane, code=command.code)
+    started = time.monotonic()
+    process = None
+    if callables.is_callable(command.code):
+        # Called in-process as forking next to running threads might deadlock
+        baseline = resources.snapshot()
+        returncode, output = callables.call(command.code, environ, capture=True)
+        resources.record(command, returncode, started, resources.snapshot(), baseline)
+        stream = io.BytesIO(output)
+    else:
+        process = _popen(command, environ,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        stream = process.stdout
+    error = None
+    with stream:
+        try:
+            output, size, spilled = _read_variable(stream, command, capture)
+        except _CaptureError as exception:
+            error = str(exception)
+            if process:
+                os.kill(process.pid, signal.SIGKILL)
+    if process:
+        returncode = resources.wait(process, started, command)
+    trace.end(command.variable, lane=lane, returncode=returncode)
+    if error:
+        helpers.print_message('general', message=error)
+        exit(1)
+    return returncode, output, size, spilled
+
+
+def _read_variable(stream, command, capture=None):
+    limit = _get_capture_setting(command, capture, 'limit')
+    overflow = _get_capture_setting(command, capture, 'overflow')
+    encoding = _get_capture_setting(command, capture, 'encoding')
+    errors = _get_capture_setting(command, capture, 'errors')
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+    chunks = []
+    parts = []
+    size = 0
+    spill = None
+    try:
+        for chunk in iter(lambda: stream.read1(_READ_SIZE), b''):
+            size += len(chunk)
+
+            # Spill to file
+            if spill is None and size > limit:
+                if overflow != 'spill':
+                    message = '[run] Variable "%s" output exceeds %s bytes'
+                    raise _CaptureError(message % (command.variable, limit))
+                spill = tempfile.NamedTemporaryFile(
+                    prefix='run-%s-' % command.variable, delete=False)
+                atexit.register(_remove_file, spill.name)
+                spill.write(b''.join(chunks))
+                chunks = parts = None
+            if spill is not None:
+                spill.write(chunk)
+                continue
+
+            # Decode incrementally
+            chunks.append(chunk)
+            parts.append(decoder.decode(chunk))
+
+        if spill is not None:
+            spill.close()
+            return spill.name, size, True
+        parts.append(decoder.decode(b'', final=True))
+    except UnicodeDecodeError as exception:
+        message = '[run] Variable "%s" output is not valid %s (%s)'
+        raise _CaptureError(message % (command.variable, encoding, exception.reason))
+    return ''.join(parts).strip(), size, False
+
+
+class _CaptureError(Exception):
+    pass
+
+
+def _get_capture_setting(command, capture, name):
+    value = command.options.get(name)
+    if value is None:
+        value = (capture or {}).get(name)
+    if value is None:
+        value = _CAPTURE_DEFAULTS[name]
+    return value
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _execute_session(commands, environ, quiet=False):
+    session = None
+    lane = trace.lane('session')
+    capture = any(results.is_tracked(command) for command in commands)
     for command in commands:
 
-        # Log process
+        # Create session
+        if session is None:
+            session = _open_session(environ, capture=capture)
+        process, code_file, status_file = session
+
+        # Log command
         if not quiet:
             sys.stdout.write('[run] Launched "%s"\n' % command.code)
             sys.stdout.flush()
 
-        # Create process
-        process = subprocess.Popen(
-            apply_faketty(command.code, faketty=faketty), bufsize=64, env=environ,
-            shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        # Send command
+        trace.begin(command.code, lane=lane, task=command.name)
+        started = time.monotonic()
+        try:
+            code_file.write(command.code.encode('utf-8') + b'\0')
+            if capture:
+                status = _relay_session(process, status_file, command)
+            else:
+                status = status_file.readline().strip()
+        except BrokenPipeError:
+            status = b''
 
-        # Create listener
-        listener = select.poll()
-        listener.register(process.stdout, select.POLLIN)
+        # Command called exit (the next command gets a fresh session)
+        if not status:
+            _close_session(session)
+            session = None
+            status = str(process.returncode).encode()
+        returncode = int(status)
+        trace.end(command.code, lane=lane, returncode=returncode)
+        resources.record(command, returncode, started, None)
+        results.finish(command, returncode)
 
-        # Register process
-        color = next(color_iterator)
-        processes.append((command, process, listener, color))
+        # Check status
+        if returncode != 0:
+            if session:
+                _close_session(session)
+            message = '[run] Command "%s" has failed' % command.code
+            helpers.print_message('general', message=message)
+            exit(1)
 
-    # Wait processes
-    while processes:
-        for index, (command, process, listener, color) in enumerate(processes):
-
-            # Process output
-            if multiplex or index == 0:
-                while listener.poll(1000):
-                    line = process.stdout.readline()
-                    if not line:
-                        break
-                    _print_line(line, command.name, color,
-                        multiplex=multiplex, quiet=quiet)
+    # Close session
+    if session:
+        _close_session(session)
 
-            # Process finish
-            if process.poll() is not None:
-                if process.returncode != 0:
-                    for line in process.stdout.readlines():
-                        _print_line(line, command.name, color,
-                            multiplex=multiplex, quiet=quiet)
-                    message = '[run] Command "%s" has failed' % command.code
-                    helpers.print_message('general', message=message)
-                    exit(1)
-                if index == 0:
-                    processes.pop(index)
+
+def _open_session(environ, capture=False):
+    code_read, code_write = os.pipe()
+    status_read, status_write = os.pipe()
+    options = {}
+    if capture:
+        options = {'stdout': subprocess.PIPE, 'stderr': subprocess.STDOUT}
+    process = subprocess.Popen(
+        ['/bin/bash', '-c', _SESSION_SCRIPT, 'run', str(code_read), str(status_write)],
+        env=environ, pass_fds=[code_read, status_write], **options)
+    os.close(code_read)
+    os.close(status_write)
+    if capture:
+        os.set_blocking(process.stdout.fileno(), False)
+    return process, os.fdopen(code_write, 'wb', 0), os.fdopen(status_read, 'rb')
+
+
+def _relay_session(process, status_file, command):
+    # Output is relayed until the command reports its status (or the shell exits)
+    output = process.stdout.fileno()
+    status = b''
+    with selectors.DefaultSelector() as selector:
+        selector.register(output, selectors.EVENT_READ)
+        selector.register(status_file.fileno(), selectors.EVENT_READ)
+        while not status.endswith(b'\n'):
+            events = selector.select()
+            if any(key.fd == output for key, _ in events):
+                if not _relay_output(output, command):
+                    selector.unregister(output)
+            if any(key.fd != output for key, _ in events):
+                chunk = os.read(status_file.fileno(), _READ_SIZE)
+                if not chunk:
                     break
+                status += chunk
+    _relay_output(output, command)
+    return status.strip()
 
 
-# Internal
+def _relay_output(descriptor, command):
+    stream = getattr(sys.stdout, 'buffer', sys.stdout)
+    while True:
+        try:
+            chunk = os.read(descriptor, _READ_SIZE)
+        except BlockingIOError:
+            return True
+        if not chunk:
+            return False
+        results.capture(command, chunk)
+        stream.write(chunk)
+        stream.flush()
+
+
+def _close_session(session):
+    process, code_file, status_file = session
+    try:
+        code_file.close()
+    except BrokenPipeError:
+        pass
+    status_file.close()
+    if process.stdout:
+        process.stdout.close()
+    process.wait()
+
+
+class _Child(object):
+
+    # Public
+
+    def __init__(self, command, color):
+        self.command = command
+        self.color = color
+        self.process = None
+        self.stdout = None
+        self.exitfd = None
+        self.exited = False
+        self.closed = False
+        self.finished = False
+        self.cancelled = False
+        self.lane = 0
+        self.started = None
+        self.tracked = False
+        self.tokens = None
+        self.stamp = None
+        self.suppressed = 0
+        self._started = False
+        self._partial = None
+        self._buffer = b''
+        self._lines = []
+
+    @property
+    def running(self):
+        return bool(self.process) and not self.finished
+
+    @property
+    def failed(self):
+        return self.finished and not self.cancelled and self.process.returncode != 0
+
+    def launch(self, environ, faketty=False):
+        self.lane = trace.lane(self.command.name)
+        trace.begin(self.command.code, lane=self.lane, task=self.command.name)
+        self.started = time.monotonic()
+        self.tracked = results.is_tracked(self.command)
+        if callables.is_callable(self.command.code):
+            if faketty:
+                self.stdout, writer = open_faketty()
+            else:
+                self.stdout, writer = os.pipe()
+            self.process = callables.spawn(self.command.code, environ, writer)
+            os.close(writer)
+        elif faketty:
+            self.process, self.stdout = popen_faketty(self.command.code,
+                program=_get_program(self.command, environ), env=environ)
+        else:
+            self.process = _popen(self.command, environ, bufsize=0,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **_GROUP_OPTIONS)
+            self.stdout = self.process.stdout.fileno()
+        self.exitfd = _open_exitfd(self.process.pid)
+        os.set_blocking(self.stdout, False)
+
+    def read(self, drain=False):
+        while True:
+            try:
+                chunk = os.read(self.stdout, _READ_SIZE)
+            except BlockingIOError:
+                return True
+            except OSError as exception:
+                # Terminal's master side reports the end with EIO
+                if exception.errno != errno.EIO:
+                    raise
+                chunk = b''
+            if not chunk:
+                self.closed = True
+                return False
+            if not self._started:
+                trace.instant('first output', lane=self.lane)
+                self._started = True
+            if self.tracked:
+                results.capture(self.command, chunk)
+            if not self._buffer:
+                self._partial = time.monotonic()
+            self._buffer += chunk
+            index = self._buffer.rfind(b'\n')
+            if index != -1:
+                for line in self._buffer[:index].split(b'\n'):
+                    self._lines.append(line + b'\n')
+                self._buffer = self._buffer[index + 1:]
+                self._partial = time.monotonic()
+            if not drain:
+                return True
+
+    def poll(self):
+        return resources.wait(self.process, self.started, self.command, block=False)
+
+    def finish(self):
+        resources.wait(self.process, self.started, self.command)
+        trace.end(self.command.code, lane=self.lane, returncode=self.process.returncode)
+        results.finish(self.command, None if self.cancelled else self.process.returncode)
+        if self._buffer:
+            self._lines.append(self._buffer)
+            self._buffer = b''
+        if self.exitfd is not None:
+            os.close(self.exitfd)
+        if self.process.stdout:
+            self.process.stdout.close()
+        else:
+            os.close(self.stdout)
+        self.finished = True
+
+    def cancel(self, signum):
+        self.cancelled = True
+        try:
+            os.killpg(self.process.pid, signum)
+        except OSError:
+            pass
+
+    def pop_lines(self, partial_timeout=None):
+        if self._buffer and partial_timeout is not None:
+            if self.get_partial_timeout(partial_timeout) == 0 or len(self._buffer) >= _READ_SIZE:
+                self._lines.append(self._buffer + b'\n')
+                self._buffer = b''
+        lines = self._lines
+        self._lines = []
+        return lines
+
+    def get_partial_timeout(self, partial_timeout):
+        if not self._buffer:
+            return None
+        return max(self._partial + partial_timeout - time.monotonic(), 0)
+
+
+def _wait_children(selector, children, timeout=None):
+
+    # Read ready pipes
+    if any(child.running and child.exitfd is None for child in children):
+        timeout = _min_timeout(timeout, _POLL_TIMEOUT)
+    for key, _ in selector.select(timeout):
+        child, event = key.data
+        if event == 'output':
+            if not child.read():
+                selector.unregister(child.stdout)
+        if event == 'exit':
+            selector.unregister(child.exitfd)
+            child.exited = True
+
+    # Detect finished processes
+    count = 0
+    for child in children:
+        if not child.running:
+            continue
+        if child.exited or child.poll() is not None:
+            if not child.closed:
+                child.read(drain=True)
+                selector.unregister(child.stdout)
+            child.finish()
+            count += 1
+
+    return count
+
+
+def _terminate_children(selector, children, grace_period=None):
+    if grace_period is None:
+        grace_period = _GRACE_PERIOD
+
+    # Send SIGTERM
+    for child in children:
+        if child.running:
+            child.cancel(signal.SIGTERM)
+
+    # Send SIGKILL
+    deadline = time.monotonic() + grace_period
+    while any(child.running for child in children):
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            for child in children:
+                if child.running:
+                    child.cancel(signal.SIGKILL)
+            timeout = _POLL_TIMEOUT
+        _wait_children(selector, children, timeout)
+
+
+def _handle_signals():
+    # Handlers can only be installed from the main thread
+    if threading.current_thread() is not threading.main_thread():
+        return None
+    handlers = {}
+    for signum in [signal.SIGTERM, signal.SIGHUP]:
+        handlers[signum] = signal.signal(signum, _raise_terminated)
+    return handlers
+
+
+def _restore_signals(handlers):
+    for signum, handler in (handlers or {}).items():
+        signal.signal(signum, handler)
+
+
+def _raise_terminated(signum, frame):
+    raise _Terminated(signum)
+
+
+class _Terminated(SystemExit):
+
+    # Public
+
+    def __init__(self, signum):
+        super(_Terminated, self).__init__(128 + signum)
+
+
+class _Cancel(object):
+
+    # Public
+
+    def __init__(self):
+        self.signum = None
+        self._lock = threading.Lock()
+        self._processes = set()
+
+    @property
+    def cancelled(self):
+        return self.signum is not None
+
+    def register(self, process):
+        with self._lock:
+            self._processes.add(process)
+            if self.signum is not None:
+                _send_signal(process, self.signum)
+
+    def unregister(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+    def cancel(self, signum):
+        with self._lock:
+            self.signum = signum
+            for process in self._processes:
+                _send_signal(process, signum)
+
+
+def _send_signal(process, signum):
+    try:
+        os.killpg(process.pid, signum)
+    except OSError:
+        pass
+
+
+def _is_overloaded(max_load=None, min_memory=None):
+
+    # Load average
+    if max_load is not None:
+        if os.getloadavg()[0] > max_load:
+            return True
+
+    # Available memory
+    if min_memory is not None:
+        try:
+            with open('/proc/meminfo', 'rb') as file:
+                for line in file:
+                    if line.startswith(b'MemAvailable:'):
+                        if int(line.split()[1]) < min_memory * 1024:
+                            return True
+                        break
+        except (OSError, ValueError):
+            pass
+
+    return False
+
+
+def _open_exitfd(pid):
+    try:
+        return os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        return None
+
+
+def _sort_longest_first(children, durations=None):
+    # Unknown durations go first as they might be the longest
+    def key(child):
+        duration = (durations or {}).get(child.command)
+        return -duration if duration is not None else -float('inf')
+    return sorted(children, key=key)
+
+
+def _popen(command, environ, **options):
+    program = _get_program(command, environ)
+    if program:
+        path, argv = program
+        try:
+            return subprocess.Popen(argv, executable=path, env=environ, **options)
+        except OSError as exception:
+            # Scripts without a shebang are left to the shell (it runs them itself)
+            if exception.errno not in _NOT_EXECUTABLE:
+                raise
+    return subprocess.Popen(command.code, shell=True, env=environ, **options)
+
+
+def _get_program(command, environ):
+    if command.options.get('shell'):
+        return None
+    return direct.get_argv(command.code, environ)
+
+
+def _tee_output(process, command):
+    stream = getattr(sys.stdout, 'buffer', sys.stdout)
+    for chunk in iter(lambda: process.stdout.read1(_READ_SIZE), b''):
+        results.capture(command, chunk)
+        stream.write(chunk)
+        stream.flush()
+    process.stdout.close()
+
+
+def _min_timeout(*timeouts):
+    timeouts = [timeout for timeout in timeouts if timeout is not None]
+    return min(timeouts) if timeouts else None
+
+
+class _Output(object):
+
+    # Public
+
+    def __init__(self, writer, children, multiplex=False, quiet=False, rate=None, log=None):
+        self.writer = writer
+        self.children = children
+        self.multiplex = multiplex
+        self.quiet = quiet
+        self.rate = rate if multiplex else None
+        self.log = open(log, 'ab') if log else None
+
+    @property
+    def timeout(self):
+        if not self.multiplex:
+            return None
+        return _min_timeout(*[child.get_partial_timeout(_PARTIAL_TIMEOUT)
+            for child in self.children if child.running])
+
+    def write(self, child):
+        name = child.command.name if self.multiplex and not self.quiet else None
+        lines = child.pop_lines(_PARTIAL_TIMEOUT if self.multiplex else None)
+
+        # Log lines
+        if self.log and lines:
+            prefix = ('%s | ' % child.command.name).encode('utf-8')
+            self.log.write(b''.join(prefix + line for line in lines))
+
+        # Limit lines
+        if self.rate:
+            lines = self._limit(child, lines)
+
+        self.writer.write(lines, name, child.color)
+
+    def close(self):
+        if self.log:
+            self.log.close()
+            self.log = None
+
+    # Private
+
+    def _limit(self, child, lines):
+
+        # Refill fair share
+        now = time.monotonic()
+        share = self.rate / max(len([other for other in self.children if other.running]), 1)
+        if child.tokens is None:
+            child.tokens = share
+        else:
+            child.tokens = min(child.tokens + (now - child.stamp) * share, share)
+        child.stamp = now
 
-def _print_line(line, name, color, multiplex=False, quiet=False):
-    line = line.replace(b'\r\n', b'\n')
-    if multiplex and not quiet:
-        click.echo(click.style('%s | ' % name, fg=color), nl=False)
-    buffer = getattr(sys.stdout, 'buffer', sys.stdout)
-    buffer.write(line)
-    sys.stdout.flush()
+        # Allow lines
+        count = min(int(child.tokens), len(lines))
+        child.tokens -= count
+        head = []
+        if child.suppressed and count:
+            head = [_SUPPRESSED % child.suppressed]
+            child.suppressed = 0
+        child.suppressed += len(lines) - count
+        tail = []
+        if child.suppressed and child.finished:
+            tail = [_SUPPRESSED % child.suppressed]
+            child.suppressed = 0
+        return head + lines[:count] + tail
@@ -4,26 +4,79 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import shlex
+import os
+import pty
+import errno
+import sys
+import fcntl
+import shutil
+import struct
+import termios
+import threading
+import subprocess
 
 
 # Module API
 
-def apply_faketty(code, faketty=False):
-    if faketty:
-        code = "python -m run.faketty /bin/bash -c %s" % shlex.quote(code)
-    return code
+def open_faketty():
+    master, slave = pty.openpty()
+    columns, lines = shutil.get_terminal_size()
+    size = struct.pack('HHHH', lines, columns, 0, 0)
+    fcntl.ioctl(slave, termios.TIOCSWINSZ, size)
+    return master, slave
 
 
-# Main program
+def popen_faketty(code, program=None, env=None, **options):
 
-if __name__ == '__main__':
+    # Create terminal
+    master, slave = open_faketty()
 
-    import sys
-    import pexpect
+    # Create process (a session leader with the terminal as the controlling one)
+    try:
+        shell = ('/bin/bash', ['/bin/bash', '-c', code])
+        try:
+            process = _popen_terminal(code, program or shell, slave, env, options)
+        except OSError as exception:
+            # Scripts without a shebang are left to the shell (it runs them itself)
+            if not program or exception.errno not in _NOT_EXECUTABLE:
+                raise
+            process = _popen_terminal(code, shell, slave, env, options)
+    except Exception:
+        os.close(master)
+        raise
+    finally:
+        os.close(slave)
 
-    child = pexpect.spawn(sys.argv[1], sys.argv[2:])
-    child.logfile_read = sys.stdout.buffer
-    child.expect(pexpect.EOF)
-    child.close()
-    exit(child.exitstatus)
+    return process, master
+
+
+# Internal
+
+_NOT_EXECUTABLE = (errno.ENOEXEC, errno.EACCES)
+_ACQUIRE = '''
+import os, sys, fcntl, errno, termios
+fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+try:
+    os.execv(sys.argv[2], sys.argv[3:])
+except OSError as exception:
+    if exception.errno not in (errno.ENOEXEC, errno.EACCES):
+        raise
+    os.execv('/bin/bash', ['/bin/bash', '-c', sys.argv[1]])
+'''
+
+
+def _popen_terminal(code, program, slave, env, options):
+    executable, args = program
+    options = dict(options)
+    if threading.active_count() > 1:
+        # Python code can't safely run after a fork while other threads are running
+        args = [sys.executable, '-c', _ACQUIRE, code, executable] + args
+        executable = None
+    else:
+        options['preexec_fn'] = _acquire_terminal
+    return subprocess.Popen(args, executable=executable, env=env, start_new_session=True,
+        stdin=slave, stdout=slave, stderr=slave, **options)
+
+
+def _acquire_terminal():
+    fcntl.ioctl(0, termios.TIOCSCTTY, 0)
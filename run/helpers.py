@@ -4,16 +4,19 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
-import io
 import os
+import time
 import yaml
 import click
+import hashlib
 from itertools import cycle
+from . import cache
+from . import __version__
 
 
 # Module API
 
-def read_config(path='run.yml'):
+def read_config(path='run.yml', nocache=False):
 
     # Bad file
     if not os.path.isfile(path):
@@ -21,24 +24,76 @@ def read_config(path='run.yml'):
         print_message('general', message=message)
         exit(1)
 
-    # Read documents
-    with io.open(path, encoding='utf-8') as file:
+    # Read cache
+    stat = cache.get_file_stat(path)
+    cache_path = cache.get_cache_path('config', cache.get_file_key(path))
+    entry = None if nocache else cache.load_pickle(cache_path)
+    if entry and entry.get('version') != _CACHE_VERSION:
+        entry = None
+    if entry and entry['stat'] == stat and stat[0] < entry['time'] - _CACHE_RACE:
+        return _mount_includes(path, entry['config'], entry['options'])
+
+    # Read contents
+    with open(path, 'rb') as file:
         contents = file.read()
-    documents = list(yaml.load_all(contents))
+    hash = hashlib.sha1(contents).hexdigest()
+    if entry and entry['hash'] == hash:
+        config, options = entry['config'], entry['options']
+    else:
+        config, options = _parse_config(contents.decode('utf-8'))
+
+    # Write cache
+    if not nocache:
+        cache.dump_pickle(cache_path, {
+            'version': _CACHE_VERSION,
+            'time': time.time_ns(),
+            'stat': stat,
+            'hash': hash,
+            'config': config,
+            'options': options,
+        })
+
+    return _mount_includes(path, config, options)
+
+
+def print_message(type, **data):
+    text = click.style(data['message'], bold=True)
+    click.echo(text)
+
+
+def iter_colors():
+    for color in cycle(_COLORS):
+        yield color
+
+
+# Internal
+
+_CACHE_VERSION = '%s:2' % __version__
+_CACHE_RACE = 2 * 10 ** 9
+_LOADER = getattr(yaml, 'CLoader', yaml.Loader)
+
+
+def _parse_config(contents):
+    contents = contents.replace('\r\n', '\n').replace('\r', '\n')
+
+    # Read documents
+    documents = list(yaml.load_all(contents, Loader=_LOADER))
 
     # Get config
     comments = []
     config = {'run': []}
     raw_config = documents[0]
     for line in contents.split('\n'):
+        if line.startswith('---') and config['run']:
+            break
         if line.startswith('# '):
             comments.append(line.replace('# ', ''))
             continue
-        for key, value in raw_config.items():
-            if line.startswith(key):
-                config['run'].append({key: {'code': value, 'desc': '\n'.join(comments)}})
-        if not line.startswith('# '):
-            comments = []
+        if line and not line[0].isspace():
+            for key, value in raw_config.items():
+                if line.startswith(key):
+                    config['run'].append({key: {'code': value, 'desc': '\n'.join(comments)}})
+        comments = []
 
     # Get options
     options = {}
@@ -48,17 +103,18 @@ def read_config(path='run.yml'):
     return config, options
 
 
-def print_message(type, **data):
-    text = click.style(data['message'], bold=True)
-    click.echo(text)
-
-
-def iter_colors():
-    for color in cycle(_COLORS):
-        yield color
-
+def _mount_includes(path, config, options):
+    descriptors = []
+    dirname = os.path.dirname(path)
+    for name, include_path in (options.get('includes') or {}).items():
+        include_path = os.path.normpath(os.path.join(dirname, include_path))
+        descriptors.append({name: {
+            'code': {'include': include_path},
+            'desc': 'Tasks from "%s"' % include_path}})
+    if descriptors:
+        config = {'run': config['run'] + descriptors}
+    return config, options
 
-# Internal
 
 _COLORS = [
     'cyan',
@@ -4,10 +4,16 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import io
 import os
+import json
 import datetime
 from copy import copy
+from .state import State
 from . import executors
+from . import resources
+from . import results
+from . import helpers
 
 
 # Module API
@@ -16,16 +22,21 @@ class Plan(object):
 
     # Public
 
-    def __init__(self, commands, mode):
+    def __init__(self, commands, mode, graph=None):
         self._commands = commands
         self._mode = mode
+        self._graph = graph
 
     def explain(self):
 
         # Explain
         lines = []
         plain = True
+        state = State()
+        durations = _get_durations(state, self._commands)
         for command in self._commands:
+            if self._mode == 'graph' and not command.variable:
+                break
             if self._mode in ['sequence', 'parallel', 'multiplex']:
                 if not command.variable:
                     if plain:
@@ -34,12 +45,49 @@ class Plan(object):
             code = command.code
             if command.variable:
                 code = '%s="%s"' % (command.variable, command.code)
+                if command.options.get('cache'):
+                    if executors.read_variable_cache(command, os.environ) is not None:
+                        code += ' (cached)'
+            elif command.options.get('inputs'):
+                if state.check(command, dict(os.environ, RUNARGS='')):
+                    code += ' (up to date)'
+            if command.options.get('cache') and not command.variable:
+                if results.read(results.get_key(command, dict(os.environ, RUNARGS=''), state)):
+                    code += ' (cached)'
             lines.append('%s$ %s' % (' '*(0 if plain else 4), code))
+        state.close()
+
+        # Explain graph
+        if self._mode == 'graph':
+            lines.append('[GRAPH]')
+            for number, level in enumerate(executors.get_graph_levels(self._graph), start=1):
+                for node in level:
+                    line = '    [%s] %s' % (number, node['name'])
+                    if node['needs']:
+                        line += ' <- %s' % ', '.join(node['needs'])
+                    lines.append(line)
+                    for command in node['commands']:
+                        lines.append('        $ %s' % command.code)
+
+        # Explain estimate
+        total = _estimate_total(self._mode, self._commands, durations, self._graph)
+        if total is not None:
+            lines.append('[ESTIMATE]')
+            for command in self._commands:
+                if durations.get(command) is not None:
+                    lines.append('    ~%.2fs $ %s' % (durations[command], command.code))
+            lines.append('    ~%.2fs total' % total)
 
         return '\n'.join(lines)
 
-    def execute(self, argv, quiet=False, faketty=False):
+    def execute(self, argv, quiet=False, faketty=False, session=False, buffered=None,
+            nocache=False, cache_size=None, jobs=None, max_load=None, min_memory=None,
+            keep_going=False, grace_period=None, shard=None, shard_timings=None,
+            usage=False, usage_json=None, results_size=None, capture=False,
+            variable_capture=None, output_rate=None, log=None):
         commands = copy(self._commands)
+        resources.reset()
+        results.reset()
 
         # Variables
         varnames = []
@@ -49,8 +97,9 @@ class Plan(object):
                 variables.append(command)
                 varnames.append(command.variable)
                 commands.remove(command)
-        executors.execute_sync(variables,
-            environ=os.environ, quiet=quiet)
+        sources = executors.execute_variables(variables,
+            environ=os.environ, nocache=nocache, cache_size=cache_size,
+            capture=variable_capture)
         if not commands:
             print(os.environ[command.variable])
             return
@@ -67,9 +116,58 @@ class Plan(object):
             items = []
             start = datetime.datetime.now()
             for name in varnames + ['RUNARGS']:
-                items.append('%s=%s' % (name, os.environ.get(name)))
+                value = os.environ.get(name)
+                if value and len(value) > _DISPLAY_SIZE:
+                    size = len(value.encode('utf-8', 'surrogateescape'))
+                    value = '%s... (%s bytes)' % (value[:_DISPLAY_SIZE], size)
+                item = '%s=%s' % (name, value)
+                if name in sources:
+                    item += ' (%s)' % sources[name]
+                items.append(item)
             print('[run] Prepared "%s"' % '; '.join(items))
 
+        # Select shard
+        state = State()
+        durations = _get_durations(state, commands)
+        if shard:
+            total = len(commands)
+            timings = _read_timings(shard_timings) if shard_timings else {}
+            commands = _get_shard(commands, timings, shard)
+            if not quiet:
+                message = '[run] Sharded "%s/%s" (%s of %s commands)'
+                print(message % (shard[0], shard[1], len(commands), total))
+
+        # Skip up to date
+        for command in copy(commands):
+            if command.options.get('inputs'):
+                if state.check(command, os.environ):
+                    commands.remove(command)
+                    if not quiet:
+                        print('[run] Skipped "%s" (up to date)' % command.code)
+
+        # Restore cached results
+        for command in copy(commands):
+            if command.options.get('cache') and not nocache:
+                key = results.get_key(command, os.environ, state)
+                path = results.read(key)
+                output = results.restore(path) if path else None
+                if output is None:
+                    results.track(command, key, limit=results_size)
+                    continue
+                commands.remove(command)
+                if not quiet:
+                    print('[run] Cached "%s" (restored)' % command.code)
+                results.replay(output)
+
+        # Capture output
+        if capture:
+            for command in commands:
+                if not results.is_tracked(command):
+                    results.track(command)
+
+        # Release state (nested runs might need to write it)
+        state.commit()
+
         # Directive
         if self._mode == 'directive':
             executors.execute_sync(commands,
@@ -78,17 +176,49 @@ class Plan(object):
         # Sequence
         elif self._mode == 'sequence':
             executors.execute_sync(commands,
-                environ=os.environ, quiet=quiet)
+                environ=os.environ, quiet=quiet, session=session)
 
         # Parallel
         elif self._mode == 'parallel':
             executors.execute_async(commands,
-                environ=os.environ, quiet=quiet, faketty=faketty)
+                environ=os.environ, quiet=quiet, faketty=faketty, buffered=buffered,
+                jobs=jobs, max_load=max_load, min_memory=min_memory,
+                keep_going=keep_going, grace_period=grace_period, durations=durations,
+                output_rate=output_rate, log=log)
 
         # Multiplex
         elif self._mode == 'multiplex':
             executors.execute_async(commands,
-                environ=os.environ, multiplex=True, quiet=quiet, faketty=faketty)
+                environ=os.environ, multiplex=True, quiet=quiet, faketty=faketty,
+                buffered=buffered, jobs=jobs, max_load=max_load, min_memory=min_memory,
+                keep_going=keep_going, grace_period=grace_period, durations=durations,
+                output_rate=output_rate, log=log)
+
+        # Graph
+        elif self._mode == 'graph':
+            graph = []
+            for node in self._graph:
+                node = dict(node, commands=[
+                    command for command in node['commands'] if command in commands])
+                graph.append(node)
+            executors.execute_graph(graph,
+                environ=os.environ, quiet=quiet, faketty=faketty, buffered=buffered,
+                jobs=jobs, keep_going=keep_going, grace_period=grace_period,
+                durations=durations, output_rate=output_rate)
+
+        # Record state
+        for command in commands:
+            if command.options.get('inputs'):
+                state.record(command, os.environ)
+        for record in resources.get_records():
+            if not record['returncode']:
+                state.record_duration(record['name'], record['code'], record['time'])
+        state.close()
+
+        # Log stored results
+        if not quiet:
+            for command in results.get_stored():
+                print('[run] Cached "%s" (stored)' % command.code)
 
         # Log finished
         if not quiet:
@@ -96,3 +226,71 @@ class Plan(object):
             time = round((stop - start).total_seconds(), 3)
             message = '[run] Finished in %s seconds'
             print(message % time)
+
+        # Report usage
+        records = resources.get_records()
+        if usage:
+            print(resources.format_table(records))
+        if usage_json:
+            resources.write_json(usage_json, records)
+
+
+# Internal
+
+_DISPLAY_SIZE = 80
+
+
+def _get_durations(state, commands):
+    durations = {}
+    for command in commands:
+        durations[command] = state.expect_duration(command)
+    return durations
+
+
+def _read_timings(path):
+    # Usage report written by --run-usage-json on a previous run
+    try:
+        with io.open(path, encoding='utf-8') as file:
+            records = json.load(file)
+        timings = {}
+        for record in records:
+            timings[(record['name'], record['code'])] = float(record['time'])
+    except (OSError, ValueError, TypeError, KeyError) as exception:
+        message = 'Shard timings "%s" can not be read (%s)' % (path, exception)
+        helpers.print_message('general', message=message)
+        exit(1)
+    return timings
+
+
+def _get_shard(commands, timings, shard):
+    index, count = shard
+    durations = [timings.get((command.name, command.code)) for command in commands]
+
+    # Balance by count (local history differs between machines so it's never used here)
+    known = [duration for duration in durations if duration is not None]
+    if not known:
+        return commands[index - 1::count]
+
+    # Balance by duration (longest first to the least loaded shard)
+    default = sorted(known)[len(known) // 2]
+    durations = [duration if duration is not None else default for duration in durations]
+    loads = [0] * count
+    selected = set()
+    for position in sorted(range(len(commands)), key=lambda position: (-durations[position], position)):
+        target = loads.index(min(loads))
+        loads[target] += durations[position]
+        if target == index - 1:
+            selected.add(position)
+    return [command for position, command in enumerate(commands) if position in selected]
+
+
+def _estimate_total(mode, commands, durations, graph=None):
+    commands = [command for command in commands if not command.variable]
+    known = [durations[command] for command in commands if durations.get(command) is not None]
+    if not known:
+        return None
+    if mode in ['parallel', 'multiplex']:
+        return max(known)
+    if mode == 'graph':
+        return executors.get_graph_length(graph, durations)
+    return sum(known)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import json
+import time
+import resource
+import threading
+from collections import namedtuple
+
+
+# Module API
+
+def reset():
+    with _lock:
+        del _records[:]
+
+
+def wait(process, started, command, block=True):
+    try:
+        pid, status, rusage = os.wait4(process.pid, 0 if block else os.WNOHANG)
+    except ChildProcessError:
+        return process.returncode
+    if not pid:
+        return None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    record(command, process.returncode, started, rusage)
+    return process.returncode
+
+
+def snapshot():
+    return resource.getrusage(resource.RUSAGE_SELF)
+
+
+def record(command, returncode, started, rusage, baseline=None):
+    if rusage is None:
+        # Usage isn't known for commands run by a long-lived session shell
+        rusage = _Usage(*[None] * len(_Usage._fields))
+    elif baseline is not None:
+        # In-process commands are accounted as the difference on the runner itself
+        rusage = _Usage(*[
+            getattr(rusage, name) - (getattr(baseline, name) if name != 'ru_maxrss' else 0)
+            for name in _Usage._fields])
+    entry = {
+        'name': command.name,
+        'code': command.code,
+        'returncode': returncode,
+        'time': round(time.monotonic() - started, 3),
+        'user': _round(rusage.ru_utime),
+        'system': _round(rusage.ru_stime),
+        'maxrss': rusage.ru_maxrss,
+        'inblock': rusage.ru_inblock,
+        'oublock': rusage.ru_oublock,
+        'nvcsw': rusage.ru_nvcsw,
+        'nivcsw': rusage.ru_nivcsw,
+    }
+    with _lock:
+        _records.append(entry)
+
+
+def get_records():
+    with _lock:
+        return list(_records)
+
+
+def format_table(records):
+    lines = [_ROW % _HEADER]
+    for record in records:
+        lines.append(_ROW % (
+            '%.3f' % record['time'],
+            _format('%.3f', record['user']),
+            _format('%.3f', record['system']),
+            _format('%.1f', record['maxrss'] and record['maxrss'] / 1024),
+            _format('%s', record['inblock']),
+            _format('%s', record['oublock']),
+            _format('%s', record['nvcsw']),
+            _format('%s', record['nivcsw']),
+            record['code']))
+    return '\n'.join(lines)
+
+
+def write_json(path, records):
+    with io.open(path, 'w', encoding='utf-8') as file:
+        file.write(json.dumps(records, indent=2))
+
+
+# Internal
+
+_records = []
+_Usage = namedtuple('_Usage', ['ru_utime', 'ru_stime', 'ru_maxrss',
+    'ru_inblock', 'ru_oublock', 'ru_nvcsw', 'ru_nivcsw'])
+_lock = threading.Lock()
+_HEADER = ('time', 'user', 'system', 'rss MB', 'in', 'out', 'vcsw', 'ivcsw', 'command')
+_ROW = '%8s %8s %8s %8s %8s %8s %8s %8s  %s'
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+
+def _format(pattern, value):
+    return pattern % value if value is not None else '-'
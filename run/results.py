@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import tempfile
+import threading
+from . import cache
+from . import executors
+
+
+# Module API
+
+def get_results_path(*names):
+    base = os.environ.get('RUNRESULTS') or cache.get_cache_path('results')
+    return os.path.join(base, *names)
+
+
+def get_key(command, environ, state):
+    settings = command.options.get('cache')
+    if not isinstance(settings, dict):
+        settings = {}
+    code = command.code.replace('$RUNARGS', environ.get('RUNARGS', ''))
+    names = set(executors.get_references(code)) | set(settings.get('env') or [])
+    hashes = []
+    for path, mtime, size in cache.get_files_stat(command.options.get('inputs')):
+        hashes.append([os.path.relpath(path), state.hash_file(path, mtime, size)])
+    return cache.get_key(
+        code,
+        hashes,
+        [[name, environ.get(name)] for name in sorted(names)])
+
+
+def read(key):
+    path = get_results_path(key)
+    if not os.path.isfile(os.path.join(path, 'meta.json')):
+        return None
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return path
+
+
+def restore(path):
+    # The entry might be evicted concurrently so a failure is a cache miss
+    try:
+        with io.open(os.path.join(path, 'meta.json'), encoding='utf-8') as file:
+            meta = json.load(file)
+        with open(os.path.join(path, 'output'), 'rb') as file:
+            output = file.read()
+        # The cache might be shared so names escaping cwd are never trusted
+        if not all(_is_relative(name) for name in meta['files']):
+            return None
+        for name in meta['files']:
+            target = os.path.join(os.getcwd(), name)
+            dirname = os.path.dirname(target)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            shutil.copy2(os.path.join(path, 'files', name), target)
+    except (OSError, ValueError, KeyError):
+        return None
+    return output
+
+
+def replay(output):
+    if output:
+        sys.stdout.flush()
+        getattr(sys.stdout, 'buffer', sys.stdout).write(output)
+        sys.stdout.flush()
+
+
+def track(command, key=None, limit=None):
+    with _lock:
+        _tracked[command] = {'key': key, 'limit': limit, 'chunks': []}
+
+
+def is_tracked(command):
+    return command in _tracked
+
+
+def capture(command, data):
+    with _lock:
+        entry = _tracked.get(command)
+        if entry is not None:
+            entry['chunks'].append(data)
+
+
+def finish(command, returncode):
+    with _lock:
+        entry = _tracked.pop(command, None)
+    if entry is None:
+        return False
+    output = b''.join(entry['chunks'])
+    with _lock:
+        _outputs.append([command.name, command.code, output])
+    if entry['key'] is None or returncode != 0:
+        return False
+    _write(command, entry['key'], output, entry['limit'])
+    with _lock:
+        _stored.append(command)
+    return True
+
+
+def get_stored():
+    with _lock:
+        return list(_stored)
+
+
+def get_outputs():
+    with _lock:
+        return list(_outputs)
+
+
+def reset():
+    with _lock:
+        _tracked.clear()
+        del _stored[:]
+        del _outputs[:]
+
+
+# Internal
+
+_lock = threading.Lock()
+_tracked = {}
+_stored = []
+_outputs = []
+_CACHE_SIZE = 1024 * 1024 * 1024
+
+
+def _write(command, key, output, limit=None):
+    root = get_results_path()
+    try:
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        temp = tempfile.mkdtemp(dir=root, prefix='.')
+        files = []
+        for pattern in command.options.get('outputs') or []:
+            for source in sorted(glob.glob(pattern, recursive=True)):
+                name = os.path.relpath(source)
+                if not os.path.isfile(source) or name.startswith('..'):
+                    continue
+                target = os.path.join(temp, 'files', name)
+                if not os.path.isdir(os.path.dirname(target)):
+                    os.makedirs(os.path.dirname(target))
+                shutil.copy2(source, target)
+                files.append(name)
+        with open(os.path.join(temp, 'output'), 'wb') as file:
+            file.write(output)
+        meta = {'code': command.code, 'files': files, 'time': time.time()}
+        with io.open(os.path.join(temp, 'meta.json'), 'w', encoding='utf-8') as file:
+            file.write(json.dumps(meta))
+        try:
+            os.rename(temp, get_results_path(key))
+        except OSError:
+            shutil.rmtree(temp, ignore_errors=True)
+    except OSError:
+        return
+    cache.evict_directory(root, limit or _CACHE_SIZE)
+
+
+def _is_relative(name):
+    cwd = os.getcwd()
+    if os.path.isabs(name):
+        return False
+    return os.path.commonpath([cwd, os.path.abspath(os.path.join(cwd, name))]) == cwd
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import glob
+import time
+import sqlite3
+import hashlib
+from . import cache
+from . import executors
+
+
+# Module API
+
+class State(object):
+
+    # Public
+
+    def __init__(self, path=None):
+        self._path = path or cache.get_cache_path('state', 'state.db')
+        self._connection = None
+        self._broken = False
+
+    def check(self, command, environ):
+        for pattern in command.options.get('outputs') or []:
+            # Recursive glob yields "dir/" for "dir/**" even if dir is missing
+            if not any(os.path.exists(path) for path in glob.glob(pattern, recursive=True)):
+                return False
+        rows = self._execute(
+            'SELECT fingerprint FROM tasks WHERE key = ?',
+            [_get_command_key(command.name, command.code)])
+        return bool(rows) and rows[0][0] == self.fingerprint(command, environ)
+
+    def record(self, command, environ):
+        self._execute(
+            'INSERT OR REPLACE INTO tasks (key, fingerprint, time) VALUES (?, ?, ?)',
+            [_get_command_key(command.name, command.code), self.fingerprint(command, environ), time.time()],
+            write=True)
+
+    def record_duration(self, name, code, duration):
+        key = _get_command_key(name, code)
+        self._execute(
+            'INSERT INTO timings (key, duration, time) VALUES (?, ?, ?)',
+            [key, duration, time.time()], write=True)
+        self._execute(
+            'DELETE FROM timings WHERE key = ? AND rowid NOT IN '
+            '(SELECT rowid FROM timings WHERE key = ? ORDER BY time DESC LIMIT ?)',
+            [key, key, _TIMING_WINDOW], write=True)
+
+    def expect_duration(self, command):
+        rows = self._execute(
+            'SELECT duration FROM timings WHERE key = ?',
+            [_get_command_key(command.name, command.code)])
+        if not rows:
+            return None
+        durations = sorted(row[0] for row in rows)
+        return durations[len(durations) // 2]
+
+    def fingerprint(self, command, environ):
+        code = command.code.replace('$RUNARGS', environ.get('RUNARGS', ''))
+        names = sorted(set(executors.get_references(code)))
+        hashes = []
+        for path, mtime, size in cache.get_files_stat(command.options.get('inputs')):
+            hashes.append([path, self.hash_file(path, mtime, size)])
+        return cache.get_key(
+            code,
+            os.getcwd(),
+            hashes,
+            [[name, environ.get(name)] for name in names])
+
+    def hash_file(self, path, mtime, size):
+        path = os.path.abspath(path)
+        rows = self._execute(
+            'SELECT mtime, size, hash FROM files WHERE path = ?', [path])
+        if rows and rows[0][0] == mtime and rows[0][1] == size:
+            return rows[0][2]
+        hash = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(_READ_SIZE), b''):
+                hash.update(chunk)
+        hash = hash.hexdigest()
+        self._execute(
+            'INSERT OR REPLACE INTO files (path, mtime, size, hash) VALUES (?, ?, ?, ?)',
+            [path, mtime, size, hash], write=True)
+        return hash
+
+    def commit(self):
+        # Writes are batched but the lock must not be held while commands run
+        if self._connection:
+            try:
+                self._connection.commit()
+            except sqlite3.Error:
+                pass
+
+    def close(self):
+        if self._connection:
+            self.commit()
+            self._connection.close()
+            self._connection = None
+
+    # Private
+
+    def _execute(self, query, params=(), write=False):
+        # Any storage error degrades to having no history
+        connection = self._connect(write)
+        if connection is None:
+            return []
+        try:
+            return connection.execute(query, params).fetchall()
+        except sqlite3.Error:
+            return []
+
+    def _connect(self, write=False):
+        if self._connection is None and not self._broken:
+            if not write and not os.path.isfile(self._path):
+                return None
+            connection = None
+            try:
+                dirname = os.path.dirname(self._path)
+                if not os.path.isdir(dirname):
+                    os.makedirs(dirname)
+                connection = sqlite3.connect(self._path, timeout=10)
+                for statement in _SCHEMA:
+                    connection.execute(statement)
+            except (OSError, sqlite3.Error):
+                if connection:
+                    connection.close()
+                self._broken = True
+                return None
+            self._connection = connection
+        return self._connection
+
+
+# Internal
+
+_READ_SIZE = 1024 * 1024
+_TIMING_WINDOW = 10
+_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, hash TEXT)',
+    'CREATE TABLE IF NOT EXISTS tasks (key TEXT PRIMARY KEY, fingerprint TEXT, time REAL)',
+    'CREATE TABLE IF NOT EXISTS timings (key TEXT, duration REAL, time REAL)',
+    'CREATE INDEX IF NOT EXISTS timings_key ON timings (key)',
+]
+
+
+def _get_command_key(name, code):
+    return cache.get_key(os.getcwd(), name, code)
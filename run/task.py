@@ -6,17 +6,27 @@ from __future__ import unicode_literals
 
 from .command import Command
 from .plan import Plan
+from . import completion
+from . import executors
 from . import helpers
 
 
 # Module API
 
 class Task(object):
+    __slots__ = [
+        '_parent', '_parents', '_qualified_name',
+        '_name', '_code', '_type', '_desc', '_quiet', '_childs', '_descriptors',
+        '_options', '_optional', '_include',
+        '_flatten_setup_tasks', '_flatten_general_tasks', '_flatten_childs_with_composite',
+        '_childs_by_name', '_childs_by_letter', '_general_tasks_by_name',
+    ]
 
     # Public
 
     def __init__(self, descriptor, options={}, parent=None, parent_type=None, quiet=False):
         self._parent = parent
+        self._parents = parent.parents + [parent] if parent else []
 
         # Prepare
         desc = '' if parent else 'General run description'
@@ -25,6 +35,12 @@ class Task(object):
             desc = code['desc']
             code = code['code']
 
+        # Include
+        include = None
+        if isinstance(code, dict):
+            include = code['include']
+            code = []
+
         # Optional
         optional = False
         if name.startswith('/'):
@@ -45,7 +61,7 @@ class Task(object):
             desc = 'Prints the variable'
 
         # Sequence type
-        childs = []
+        descriptors = []
         if isinstance(code, list):
             type = 'sequence'
 
@@ -55,7 +71,7 @@ class Task(object):
 
             # Parallel type
             if name.startswith('(') and name.endswith(')'):
-                if len(self.parents) >= 2:
+                if len(self.parents) >= 2 and parent_type != 'graph':
                     message = 'Subtask descriptions and execution control not supported'
                     helpers.print_message('general', message=message)
                     exit(1)
@@ -67,15 +83,8 @@ class Task(object):
                 name = name[1:-1]
                 type = 'multiplex'
 
-            # Create childs
-            for descriptor in code:
-                if not isinstance(descriptor, dict):
-                    descriptor = {'': descriptor}
-                child = Task(descriptor,
-                    options=options, parent=self, parent_type=type, quiet=quiet)
-                childs.append(child)
-
             # Reset code
+            descriptors = code
             code = None
 
         # Set attributes
@@ -84,9 +93,29 @@ class Task(object):
         self._type = type
         self._desc = desc
         self._quiet = quiet
-        self._childs = childs
+        self._childs = []
+        self._descriptors = descriptors
         self._options = options
         self._optional = optional
+        self._include = include
+        self._qualified_name = ' '.join(
+            task.name for task in self._parents + [self] if task.name)
+
+        # Graph type
+        if type == 'sequence' and parent and _has_needs_childs(self):
+            self._type = 'graph'
+
+        # Reset indexes
+        self._flatten_setup_tasks = None
+        self._flatten_general_tasks = None
+        self._flatten_childs_with_composite = None
+        self._childs_by_name = None
+        self._childs_by_letter = None
+        self._general_tasks_by_name = None
+
+        # Create childs (includes are loaded on first traversal)
+        if not options.get('lazy') and not include:
+            self._create_childs()
 
     @property
     def name(self):
@@ -114,6 +143,10 @@ class Task(object):
 
     @property
     def childs(self):
+        if self._include and self._descriptors == []:
+            self._load_include()
+        if self._descriptors:
+            self._create_childs()
         return self._childs
 
     @property
@@ -124,9 +157,13 @@ class Task(object):
     def optional(self):
         return self._optional
 
+    @property
+    def include(self):
+        return self._include
+
     @property
     def composite(self):
-        return bool(self._childs)
+        return bool(self._childs or self._descriptors or self._include)
 
     @property
     def is_root(self):
@@ -134,80 +171,84 @@ class Task(object):
 
     @property
     def parents(self):
-        parents = []
-        task = self
-        while True:
-            if not task.parent:
-                break
-            parents.append(task.parent)
-            task = task.parent
-        return list(reversed(parents))
+        return self._parents
 
     @property
     def qualified_name(self):
-        names = []
-        for parent in (self.parents + [self]):
-            if parent.name:
-                names.append(parent.name)
-        return ' '.join(names)
+        return self._qualified_name
 
     @property
     def flatten_setup_tasks(self):
-        tasks = []
-        for parent in self.parents:
-            for task in parent.childs:
-                if task is self:
-                    break
-                if task in self.parents:
-                    break
-                if task.type == 'variable':
-                    tasks.append(task)
-        return tasks
+        if self._flatten_setup_tasks is None:
+            tasks = []
+            parents = set(map(id, self.parents))
+            for parent in self.parents:
+                for task in parent.childs:
+                    if task is self:
+                        break
+                    if id(task) in parents:
+                        break
+                    if task.type == 'variable':
+                        tasks.append(task)
+            self._flatten_setup_tasks = tasks
+        return self._flatten_setup_tasks
 
     @property
     def flatten_general_tasks(self):
-        tasks = []
-        for task in self.childs or [self]:
-            if task.composite:
-                tasks.extend(task.flatten_general_tasks)
-                continue
-            tasks.append(task)
-        return tasks
+        if self._flatten_general_tasks is None:
+            tasks = []
+            for task in self.childs or [self]:
+                if task.composite:
+                    tasks.extend(task.flatten_general_tasks)
+                    continue
+                tasks.append(task)
+            self._flatten_general_tasks = tasks
+        return self._flatten_general_tasks
 
     @property
     def flatten_childs_with_composite(self):
-        tasks = []
-        for task in self.childs:
-            tasks.append(task)
-            if task.composite:
-                tasks.extend(task.flatten_childs_with_composite)
-        return tasks
+        if self._flatten_childs_with_composite is None:
+            tasks = []
+            for task in self.childs:
+                tasks.append(task)
+                if task.composite:
+                    tasks.extend(task.flatten_childs_with_composite)
+            self._flatten_childs_with_composite = tasks
+        return self._flatten_childs_with_composite
+
+    def find_child_task_by_name(self, name):
+        if self._childs_by_name is None:
+            self._childs_by_name = {}
+            for task in self.childs:
+                self._childs_by_name.setdefault(task.name, task)
+        return self._childs_by_name.get(name)
 
     def find_child_tasks_by_name(self, name):
-        tasks = []
-        for task in self.flatten_general_tasks:
-            if task.name == name:
-                tasks.append(task)
-        return tasks
+        if self._general_tasks_by_name is None:
+            self._general_tasks_by_name = {}
+            for task in self.flatten_general_tasks:
+                self._general_tasks_by_name.setdefault(task.name, []).append(task)
+        return list(self._general_tasks_by_name.get(name, []))
 
     def find_child_task_by_abbrevation(self, abbrevation):
-        letter = abbrevation[0]
-        abbrev = abbrevation[1:]
-        for task in self.childs:
-            if task.name.startswith(letter):
-                if abbrev:
-                    return task.find_child_task_by_abbrevation(abbrev)
-                return task
-        return None
+        if self._childs_by_letter is None:
+            self._childs_by_letter = {}
+            for task in self.childs:
+                if task.name:
+                    self._childs_by_letter.setdefault(task.name[0], task)
+        task = self._childs_by_letter.get(abbrevation[0])
+        if task and abbrevation[1:]:
+            return task.find_child_task_by_abbrevation(abbrevation[1:])
+        return task
 
     def run(self, argv):
         commands = []
 
         # Delegate by name
         if len(argv) > 0:
-            for task in self.childs:
-                if task.name == argv[0]:
-                    return task.run(argv[1:])
+            task = self.find_child_task_by_name(argv[0])
+            if task:
+                return task.run(argv[1:])
 
         # Delegate by abbrevation
         if len(argv) > 0:
@@ -217,7 +258,7 @@ class Task(object):
                     return task.run(argv[1:])
 
         # Root task
-        if self.is_root:
+        if self.is_root or self.include:
             if len(argv) > 0 and argv != ['?']:
                 message = 'Task "%s" not found' % argv[0]
                 helpers.print_message('general', message=message)
@@ -243,10 +284,12 @@ class Task(object):
 
         # Collect setup commands
         for task in self.flatten_setup_tasks:
-            command = Command(task.qualified_name, task.code, variable=task.name)
+            command = Command(task.qualified_name, task.code,
+                variable=task.name, options=_get_task_options(task))
             commands.append(command)
 
         # Collect general commands
+        task_commands = {}
         for task in self.flatten_general_tasks:
             if task is not self and task not in filters['pick']:
                 if task.optional and task not in filters['enable']:
@@ -256,9 +299,37 @@ class Task(object):
                 if filters['pick']:
                     continue
             variable = task.name if task.type == 'variable' else None
-            command = Command(task.qualified_name, task.code, variable=variable)
+            command = Command(task.qualified_name, task.code,
+                variable=variable, options=_get_task_options(task))
+            task_commands[id(task)] = command
             commands.append(command)
 
+        # Collect graph
+        graph = None
+        if self.type == 'graph':
+            graph = []
+            names = [child.name for child in self.childs]
+            for child in self.childs:
+                if child.type == 'variable':
+                    continue
+                needs = _get_task_options(child).get('needs') or []
+                for name in needs:
+                    if name not in names:
+                        message = 'Task "%s" not found' % name
+                        helpers.print_message('general', message=message)
+                        exit(1)
+                graph.append({
+                    'name': child.name,
+                    'mode': child.type,
+                    'needs': needs,
+                    'commands': [task_commands[id(task)]
+                        for task in child.flatten_general_tasks if id(task) in task_commands],
+                })
+            if executors.get_graph_levels(graph) is None:
+                message = 'Task "%s" has cyclic dependencies' % self.qualified_name
+                helpers.print_message('general', message=message)
+                exit(1)
+
         # Normalize arguments
         arguments_index = None
         for index, command in enumerate(commands):
@@ -277,7 +348,7 @@ class Task(object):
                     break
 
         # Create plan
-        plan = Plan(commands, self.type)
+        plan = Plan(commands, self.type, graph=graph)
 
         # Show help
         if help:
@@ -285,30 +356,95 @@ class Task(object):
             _print_help(task, self, plan, filters)
             exit()
 
+        # Parse shard
+        shard = self.options.get('shard')
+        if shard:
+            shard = _parse_shard(shard)
+
         # Execute commands
         plan.execute(argv,
             quiet=self.quiet,
-            faketty=self.options.get('faketty'))
+            faketty=self.options.get('faketty'),
+            session=self.options.get('session'),
+            buffered=self.options.get('buffered'),
+            nocache=self.options.get('nocache'),
+            cache_size=self.options.get('cache_size'),
+            jobs=_get_task_options(self).get('jobs', self.options.get('jobs')),
+            max_load=self.options.get('max_load'),
+            min_memory=self.options.get('min_memory'),
+            keep_going=_get_task_options(self).get('keep_going', self.options.get('keep_going')),
+            grace_period=self.options.get('grace_period'),
+            shard=shard,
+            shard_timings=self.options.get('shard_timings'),
+            results_size=self.options.get('results_size'),
+            capture=self.options.get('capture'),
+            variable_capture=self.options.get('variables'),
+            output_rate=_get_task_options(self).get('output_rate', self.options.get('output_rate')),
+            log=_get_task_options(self).get('log'),
+            usage=self.options.get('usage'),
+            usage_json=self.options.get('usage_json'))
 
         return True
 
     def complete(self, argv):
+        return completion.complete(completion.build_index(self), argv)
+
+    # Private
+
+    def _load_include(self):
+        config, options = helpers.read_config(self._include, nocache=self._options.get('nocache'))
+        tasks = dict(self._options.get('tasks') or {})
+        prefix = _get_options_name(self)
+        for name, task_options in (options.get('tasks') or {}).items():
+            tasks.setdefault('%s %s' % (prefix, name), task_options)
+        # Other options apply to the namespace unless the including config sets them
+        merged = dict((key, value) for key, value in options.items() if key != 'includes')
+        merged.update(self._options)
+        merged['tasks'] = tasks
+        self._options = merged
+        self._descriptors = config['run'] or None
+
+    def _create_childs(self):
+        descriptors = self._descriptors
+        self._descriptors = None
+        for descriptor in descriptors:
+            if not isinstance(descriptor, dict):
+                descriptor = {'': descriptor}
+            child = Task(descriptor,
+                options=self._options, parent=self, parent_type=self._type, quiet=self._quiet)
+            self._childs.append(child)
 
-        # Delegate by name
-        if len(argv) > 0:
-            for task in self.childs:
-                if task.name == argv[0]:
-                    return task.complete(argv[1:])
 
-        # Autocomplete
-        for child in self.childs:
-            if child.name:
-                print(child.name)
+# Internal
 
-        return True
+def _get_task_options(task):
+    return (task.options.get('tasks') or {}).get(_get_options_name(task)) or {}
 
 
-# Internal
+def _get_options_name(task):
+    return ' '.join(task.qualified_name.split(' ')[1:]) if task.parents else ''
+
+
+def _has_needs_childs(task):
+    prefix = '%s ' % _get_options_name(task) if task.parents else ''
+    for name, options in (task.options.get('tasks') or {}).items():
+        if name.startswith(prefix) and ' ' not in name[len(prefix):]:
+            if (options or {}).get('needs'):
+                return True
+    return False
+
+
+def _parse_shard(shard):
+    try:
+        index, count = [int(part) for part in str(shard).split('/')]
+        if not 1 <= index <= count:
+            raise ValueError()
+    except ValueError:
+        message = 'Shard "%s" is not valid (expected "i/N" with 1 <= i <= N)' % shard
+        helpers.print_message('general', message=message)
+        exit(1)
+    return index, count
+
 
 def _print_help(task, selected_task, plan=None, filters=None):
 
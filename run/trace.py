@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import io
+import json
+import time
+import atexit
+import threading
+
+
+# Module API
+
+def start(path):
+    global _file, _origin
+    stop()
+    _file = io.open(path, 'w', encoding='utf-8')
+    _file.write('[')
+    _origin = time.perf_counter()
+    _counter[0] = 0
+    _lanes.clear()
+    _write({'ph': 'M', 'name': 'process_name', 'tid': 0, 'args': {'name': 'run'}})
+    _write({'ph': 'M', 'name': 'thread_name', 'tid': 0, 'args': {'name': 'main'}})
+
+
+def stop():
+    global _file
+    with _lock:
+        if _file is not None:
+            _file.write('\n]\n')
+            _file.close()
+            _file = None
+
+
+def lane(name):
+    if _file is None:
+        return 0
+    with _lock:
+        tid = len(_lanes) + 1
+        _lanes.append(name)
+    _write({'ph': 'M', 'name': 'thread_name', 'tid': tid, 'args': {'name': name}})
+    return tid
+
+
+def begin(name, lane=0, **args):
+    if _file is not None:
+        _write({'ph': 'B', 'name': name, 'tid': lane, 'ts': _now(), 'args': args})
+
+
+def end(name, lane=0, **args):
+    if _file is not None:
+        _write({'ph': 'E', 'name': name, 'tid': lane, 'ts': _now(), 'args': args})
+
+
+def instant(name, lane=0, **args):
+    if _file is not None:
+        _write({'ph': 'i', 'name': name, 'tid': lane, 'ts': _now(), 's': 't', 'args': args})
+
+
+# Internal
+
+_file = None
+_origin = 0
+_lanes = []
+_counter = [0]
+_lock = threading.Lock()
+
+
+def _now():
+    return round((time.perf_counter() - _origin) * 1000000, 3)
+
+
+def _write(event):
+    event['pid'] = os.getpid()
+    line = json.dumps(event)
+    with _lock:
+        if _file is not None:
+            _file.write('\n' if not _counter[0] else ',\n')
+            _file.write(line)
+            _counter[0] += 1
+
+
+atexit.register(stop)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import time
+import click
+
+
+# Module API
+
+class Writer(object):
+
+    # Public
+
+    def __init__(self, buffered=None):
+        if buffered is None:
+            buffered = not sys.stdout.isatty()
+        self._buffered = buffered
+        self._stream = getattr(sys.stdout, 'buffer', sys.stdout)
+        self._prefixes = {}
+        self._chunks = []
+        self._size = 0
+        self._deadline = None
+
+    @property
+    def buffered(self):
+        return self._buffered
+
+    @property
+    def timeout(self):
+        if self._deadline is None:
+            return None
+        return max(self._deadline - time.monotonic(), 0)
+
+    def write(self, lines, name=None, color=None):
+        if not lines:
+            return
+
+        # Add lines
+        prefix = self._get_prefix(name, color)
+        for line in lines:
+            chunk = prefix + line.replace(b'\r\n', b'\n')
+            self._chunks.append(chunk)
+            self._size += len(chunk)
+
+        # Flush lines
+        if not self._buffered or self._size >= _FLUSH_SIZE:
+            return self.flush()
+        if self._deadline is None:
+            self._deadline = time.monotonic() + _FLUSH_TIME
+        elif self._deadline <= time.monotonic():
+            self.flush()
+
+    def flush(self):
+        if self._chunks:
+            sys.stdout.flush()
+            self._stream.write(b''.join(self._chunks))
+            self._stream.flush()
+        self._chunks = []
+        self._size = 0
+        self._deadline = None
+
+    # Private
+
+    def _get_prefix(self, name, color):
+        if name is None:
+            return b''
+        prefix = self._prefixes.get((name, color))
+        if prefix is None:
+            prefix = click.style('%s | ' % name, fg=color)
+            if not sys.stdout.isatty():
+                prefix = click.unstyle(prefix)
+            prefix = prefix.encode('utf-8')
+            self._prefixes[(name, color)] = prefix
+        return prefix
+
+
+# Internal
+
+_FLUSH_SIZE = 65536
+_FLUSH_TIME = 0.05
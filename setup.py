@@ -25,7 +25,6 @@ INSTALL_REQUIRES = [
     'pyyaml>=3.1,<4.0',
     'click>=6.0,<7.0',
     'emoji>=0.4,<2.0',
-    'pexpect>=4.3,<5.0',
     'python-dotenv>=0.7,<2.0',
 ]
 TESTS_REQUIRE = [
@@ -43,6 +42,7 @@ setup(
     version=VERSION,
     packages=PACKAGES,
     include_package_data=True,
+    python_requires='>=3.9',
     install_requires=INSTALL_REQUIRES,
     tests_require=TESTS_REQUIRE,
     extras_require={'develop': TESTS_REQUIRE},
@@ -67,12 +67,11 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Operating System :: OS Independent',
-        'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
         'Topic :: Internet :: WWW/HTTP :: Dynamic Content',
         'Topic :: Software Development :: Libraries :: Python Modules'
     ],
@@ -8,9 +8,19 @@ import io
 import os
 import glob
 import yaml
+import shutil
+import atexit
+import tempfile
 import pytest
 
 
+# Isolate caches and results from the user's ~/.cache/run
+CACHE_DIR = tempfile.mkdtemp(prefix='run-tests-')
+os.environ['RUNCACHE'] = os.path.join(CACHE_DIR, 'cache')
+os.environ['RUNRESULTS'] = os.path.join(CACHE_DIR, 'results')
+atexit.register(shutil.rmtree, CACHE_DIR, True)
+
+
 def pytest_generate_tests(metafunc):
     if 'scenario' in metafunc.fixturenames:
 
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+
+def greet(argv, environ):
+    print(' '.join(['hello', environ['NAME']] + argv))
+
+
+def shout(argv, environ):
+    print(' '.join(argv).upper())
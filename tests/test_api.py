@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import asyncio
+import threading
+import pytest
+from run.api import Runner, RunError, ConfigError
+
+
+# Tests
+
+def test_runner_result(tmp_path):
+    runner = Runner(write_config(tmp_path, CONFIG))
+    result = runner.run(['task'])
+    assert result.argv == ['task']
+    assert result.returncode == 0
+    assert '\n1\n[run] Launched "echo 2"\n2\n' in result.output
+    assert [command['code'] for command in result.commands] == ['echo 1 $RUNARGS', 'echo 2']
+    assert [command['output'] for command in result.commands] == ['1\n', '2\n']
+    assert [command['returncode'] for command in result.commands] == [0, 0]
+
+
+def test_runner_arguments_and_environ(tmp_path):
+    runner = Runner(write_config(tmp_path, CONFIG))
+    result = runner.run(['echo', 'hello'], environ=dict(os.environ, VALUE='value'))
+    assert 'hello value\n' in result.output
+
+
+def test_runner_run_error(tmp_path):
+    runner = Runner(write_config(tmp_path, CONFIG))
+    with pytest.raises(RunError) as excinfo:
+        runner.run(['failing'])
+    assert excinfo.value.result.returncode == 1
+    assert '\nbefore\n' in excinfo.value.result.output
+    assert 'failing' in str(excinfo.value)
+
+
+def test_runner_no_check(tmp_path):
+    runner = Runner(write_config(tmp_path, CONFIG))
+    result = runner.run(['failing'], check=False)
+    assert result.returncode == 1
+    assert result.commands[-1]['returncode'] == 3
+
+
+def test_runner_config_error_missing(tmp_path):
+    with pytest.raises(ConfigError) as excinfo:
+        Runner(str(tmp_path / 'missing.yml'))
+    assert 'missing.yml' in str(excinfo.value)
+
+
+def test_runner_config_error_invalid(tmp_path):
+    with pytest.raises(ConfigError) as excinfo:
+        Runner(write_config(tmp_path, INVALID_CONFIG))
+    assert 'not supported' in str(excinfo.value)
+
+
+def test_runner_run_async(tmp_path):
+    runner = Runner(write_config(tmp_path, CONFIG))
+    result = asyncio.run(run_alone(runner.run_async(['task'])))
+    assert '\n1\n[run] Launched "echo 2"\n2\n' in result.output
+    assert [command['output'] for command in result.commands] == ['1\n', '2\n']
+
+
+def test_runner_run_async_error(tmp_path):
+    runner = Runner(write_config(tmp_path, CONFIG))
+    with pytest.raises(RunError):
+        asyncio.run(runner.run_async(['failing']))
+
+
+def test_runner_large_output(tmp_path):
+    runner = Runner(write_config(tmp_path, CONFIG))
+    result = runner.run(['large'])
+    assert result.commands[0]['output'] == 'a\n' * 100000
+    result = asyncio.run(runner.run_async(['large']))
+    assert result.commands[0]['output'] == 'a\n' * 100000
+
+
+def test_runner_with_threads(tmp_path):
+    runner = Runner(write_config(tmp_path, CONFIG))
+    with running_thread():
+        result = runner.run(['echo', 'hello'], environ=dict(os.environ, VALUE='value'))
+        assert 'hello value\n' in result.output
+        assert result.commands[0]['output'] == 'hello value\n'
+        with pytest.raises(RunError) as excinfo:
+            runner.run(['failing'])
+        assert '\nbefore\n' in excinfo.value.result.output
+        result = asyncio.run(runner.run_async(['task']))
+        assert [command['output'] for command in result.commands] == ['1\n', '2\n']
+
+
+# Helpers
+
+CONFIG = '''
+task:
+  - echo 1
+  - echo 2
+echo: echo $RUNARGS $VALUE
+failing:
+  - echo before
+  - exit 3
+large: yes a | head -n 100000
+'''
+INVALID_CONFIG = '''
+task:
+  - subtask:
+    - (parallel):
+      - echo 1
+'''
+
+
+async def run_alone(coroutine):
+    # Waiting must not leave executor threads behind
+    result = await coroutine
+    assert threading.active_count() == 1
+    return result
+
+
+def write_config(tmp_path, text):
+    path = tmp_path / 'run.yml'
+    path.write_text(text)
+    return str(path)
+
+
+class running_thread(object):
+
+    # Public
+
+    def __enter__(self):
+        self._event = threading.Event()
+        self._thread = threading.Thread(target=self._event.wait)
+        self._thread.start()
+
+    def __exit__(self, *args):
+        self._event.set()
+        self._thread.join()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import sys
+import subprocess
+from run.state import State
+
+
+# Tests
+
+def test_estimate_parallel(tmp_path, monkeypatch):
+    monkeypatch.setenv('RUNCACHE', str(tmp_path))
+    record_durations('run task', [
+        ['echo 1 $RUNARGS', [0.5, 0.25, 0.75]],
+        ['sleep 1 && echo 2', [1.25]],
+    ])
+    assert explain('task').endswith(
+        '[ESTIMATE]\n'
+        '    ~0.50s $ echo 1 $RUNARGS\n'
+        '    ~1.25s $ sleep 1 && echo 2\n'
+        '    ~1.25s total\n')
+
+
+def test_estimate_sequence(tmp_path, monkeypatch):
+    monkeypatch.setenv('RUNCACHE', str(tmp_path))
+    record_durations('run sequence', [
+        ['echo 3 $RUNARGS', [0.5]],
+        ['echo 4', [1.25]],
+    ])
+    assert explain('sequence').endswith(
+        '[ESTIMATE]\n'
+        '    ~0.50s $ echo 3 $RUNARGS\n'
+        '    ~1.25s $ echo 4\n'
+        '    ~1.75s total\n')
+
+
+def test_estimate_recorded(tmp_path, monkeypatch):
+    monkeypatch.setenv('RUNCACHE', str(tmp_path))
+    subprocess.check_output([sys.executable, '-m', 'run.cli', 'sequence',
+        '--run-path', 'tests/scenarios/timing_estimate.yml'])
+    state = State()
+    for code in ['echo 3 $RUNARGS', 'echo 4']:
+        assert state.expect_duration(Command('run sequence', code)) is not None
+    state.close()
+
+
+# Helpers
+
+class Command(object):
+
+    # Public
+
+    def __init__(self, name, code):
+        self.name = name
+        self.code = code
+
+
+def record_durations(name, durations):
+    state = State()
+    for code, samples in durations:
+        for duration in samples:
+            state.record_duration(name, code, duration)
+    state.close()
+
+
+def explain(task):
+    return subprocess.check_output([sys.executable, '-m', 'run.cli', task, '?',
+        '--run-path', 'tests/scenarios/timing_estimate.yml']).decode()
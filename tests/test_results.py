@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+import os
+import json
+import pytest
+from run import results
+
+
+# Tests
+
+@pytest.mark.parametrize('name', ['../escaped.txt', '/tmp/escaped.txt', 'dir/../../escaped.txt'])
+def test_restore_rejects_escaping_names(tmp_path, monkeypatch, name):
+    workdir = tmp_path / 'work'
+    workdir.mkdir()
+    monkeypatch.chdir(str(workdir))
+    entry = str(tmp_path / 'entry')
+    write_entry(entry, [name])
+    (tmp_path / 'entry' / 'files' / 'dir').mkdir(parents=True)
+    (tmp_path / 'entry' / 'escaped.txt').write_text('contents')
+    assert results.restore(entry) is None
+    assert not (tmp_path / 'escaped.txt').exists()
+
+
+def test_restore_files(tmp_path, monkeypatch):
+    workdir = tmp_path / 'work'
+    workdir.mkdir()
+    monkeypatch.chdir(str(workdir))
+    entry = str(tmp_path / 'entry')
+    write_entry(entry, ['dir/restored.txt'])
+    (tmp_path / 'entry' / 'files' / 'dir').mkdir(parents=True)
+    (tmp_path / 'entry' / 'files' / 'dir' / 'restored.txt').write_text('contents')
+    assert results.restore(entry) == b'output\n'
+    assert (workdir / 'dir' / 'restored.txt').read_text() == 'contents'
+
+
+def test_restore_evicted_entry(tmp_path):
+    assert results.restore(str(tmp_path / 'missing')) is None
+
+
+# Helpers
+
+def write_entry(path, names):
+    os.makedirs(path)
+    with open(os.path.join(path, 'output'), 'wb') as file:
+        file.write(b'output\n')
+    with io.open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as file:
+        file.write(json.dumps({'code': 'echo', 'files': names, 'time': 0}))
@@ -16,12 +16,13 @@ def test_scenario_tests(config_path, scenario):
 
     # Prepare command
     command = scenario['command']
-    command = command.replace('run', 'python -m run.cli')
+    command = command.replace('run', 'python -m run.cli', 1)
     command = '%s --run-path %s' % (command, config_path)
 
     # Execute command
     start = datetime.datetime.now()
-    output = subprocess.check_output(command, shell=True).decode()
+    process = subprocess.run(command, shell=True, stdout=subprocess.PIPE)
+    output = process.stdout.decode()
     stop = datetime.datetime.now()
     time = round((stop - start).total_seconds(), 3)
     print(output)
@@ -29,4 +30,5 @@ def test_scenario_tests(config_path, scenario):
     # Assert result
     predicat = getattr(operator, scenario.get('operator', 'eq'))
     assert predicat(output, scenario['output'])
+    assert process.returncode == scenario.get('returncode', 0)
     assert time <= scenario.get('faster', time)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import sys
+import time
+import subprocess
+
+
+# Tests
+
+def test_nested_run_not_blocked(tmp_path):
+    config = (
+        'outer!: python -m run.cli inner\n'
+        'inner!: echo inner\n'
+        '---\n'
+        'tasks:\n'
+        '  outer: {inputs: [input.txt]}\n'
+        '  inner: {inputs: [input.txt]}\n')
+    (tmp_path / 'run.yml').write_text(config)
+    environ = dict(os.environ, RUNCACHE=str(tmp_path / 'cache'),
+        PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    for value in ['1', '2']:
+        # A changed input is hashed again before the commands run
+        (tmp_path / 'input.txt').write_text(value)
+        start = time.monotonic()
+        output = subprocess.check_output([sys.executable, '-m', 'run.cli', 'outer'],
+            cwd=str(tmp_path), env=environ).decode()
+        assert output == 'inner\n'
+        assert time.monotonic() - start < 5
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+import sys
+import json
+import subprocess
+
+
+# Tests
+
+def test_trace_events(tmp_path):
+    path = str(tmp_path / 'trace.json')
+    subprocess.check_output([sys.executable, '-m', 'run.cli', 'task',
+        '--run-trace', path, '--run-path', 'tests/scenarios/using_trace.yml'])
+    with io.open(path, encoding='utf-8') as file:
+        events = json.load(file)
+
+    # Lanes
+    lanes = {}
+    for event in events:
+        if event['ph'] == 'M' and event['name'] == 'thread_name':
+            lanes[event['tid']] = event['args']['name']
+    assert lanes[0] == 'main'
+
+    # Commands
+    for code in ['echo $VARIABLE $RUNARGS', 'sleep 1 && echo 2']:
+        phases = [event for event in events if event['name'] == code]
+        assert [event['ph'] for event in phases] == ['B', 'E']
+        assert phases[0]['tid'] == phases[1]['tid']
+        assert phases[0]['ts'] <= phases[1]['ts']
+        assert lanes[phases[0]['tid']] == 'run task'
+        assert phases[1]['args'] == {'returncode': 0}
+        instants = [event for event in events
+            if event['ph'] == 'i' and event['tid'] == phases[0]['tid']]
+        assert [event['name'] for event in instants] == ['first output']
+
+    # Variables
+    phases = [event for event in events if event['name'] == 'VARIABLE']
+    assert [event['ph'] for event in phases] == ['B', 'E']
+    assert lanes[phases[0]['tid']] == 'variable VARIABLE'